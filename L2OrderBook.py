@@ -13,49 +13,123 @@ import tkinter
 from colors import Colors
 
 
-class Level2OrderbookClient(WebsocketClient):    
-   
-    def __init__(self, products=['BTC-USD']):
-        super().__init__(url='wss://ws-feed.pro.coinbase.com/', products=products, channels=['level2'])
+class Level2Book(object):
+    '''
+    The level 2 book of one product: total size keyed by price for each side.
+    '''
+
+    def __init__(self, product_id):
+        self.product_id = product_id
+        self.bids = SortedDict()
+        self.asks = SortedDict()
+
+    # This method replaces the book with a snapshot message
+    def loadSnapshot(self, msg):
+        self.bids = self._side(msg['bids'])
+        self.asks = self._side(msg['asks'])
+
+    # This method builds one side from [price, size] rows in one step instead of inserting the levels one at a time
+    def _side(self, rows):
+        if not rows:
+            return SortedDict()
+        prices, sizes = zip(*rows)
+        return SortedDict(zip(map(Decimal, prices), map(Decimal, sizes)))
+
+    # This method applies the changes of an l2update message
+    def applyChanges(self, changes):
+        bids = self.bids
+        asks = self.asks
+        for side, price, size in changes:
+            # Buy messages affect bid side; sell messages affect ask side.
+            orderbook_side = bids if side == 'buy' else asks
+            price = Decimal(price)
+            size = Decimal(size)
+            if size:
+                # Overwrite entry. The size is the new amount of orders at this price; it is not a delta.
+                orderbook_side[price] = size
+            else:
+                # If the qty becomes 0, we need to get rid of this item in the order book.
+                orderbook_side.pop(price, None)
+
+    # This method returns ((best bid price, size), (best ask price, size)), None for an empty side
+    def best(self):
+        return (self.bids.peekitem(-1) if self.bids else None, self.asks.peekitem(0) if self.asks else None)
+
+
+# This function prints a best bid/ask update in color, like the client used to for every change
+def printBestBidAsk(update):
+    best_bid, best_ask = update['bid'], update['ask']
+    if best_bid is None or best_ask is None:
+        return
+    best_bid_txt = Colors.GREEN + '{0:.2f}'.format(best_bid[0]) + Colors.END
+    best_ask_txt = Colors.RED + '{0:.2f}'.format(best_ask[0]) + Colors.END
+    spread = Colors.BLUE + '{0:.2f}'.format(best_ask[0] - best_bid[0]) + Colors.END
+    print('{}\t {}\t{}'.format(best_ask_txt, spread, best_bid_txt))
+
+
+class Level2OrderbookClient(WebsocketClient):
+    '''
+    Keeps a Level2Book per product and calls every subscriber once per message that changed a product's best bid or
+    ask. Subscribers get a dict with 'product_id', 'bid' and 'ask' ((price, size), None for an empty side) and
+    'time'. Nothing is printed unless printBestBidAsk is subscribed.
+    '''
+
+    def __init__(self, products=['BTC-USD'], **kwargs):
+        kwargs.setdefault('url', 'wss://ws-feed.pro.coinbase.com/')
+        super().__init__(products=products, channels=['level2'], **kwargs)
+        self.books = {}
+        for product_id in products:
+            self.books[product_id] = Level2Book(product_id)
+        # Last (bid, ask) sent to subscribers, per product
+        self._lastBest = {}
+        self.subscribers = []
+
+    # The book of the first product
+    @property
+    def bids(self):
+        return self.books[self.products[0]].bids
+
+    @property
+    def asks(self):
+        return self.books[self.products[0]].asks
+
+    # This method registers a callback for best bid/ask updates
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
 
     def on_open(self):
         # Set connection parameters.
         pass
-    
-    def on_message(self, msg):
-        if msg['type'] == 'snapshot':
-            self.bids = SortedDict({Decimal(k): Decimal(v) for (k, v) in msg['bids']})
-            self.asks = SortedDict({Decimal(k): Decimal(v) for (k, v) in msg['asks']})
-        
-        if msg['type'] == 'l2update':
-            
-            for change in msg['changes']:
-                price = Decimal(change[1])
-                size = Decimal(change[2])
-
-                # Buy messages affect bid side; sell messages affect ask side.
-                orderbook_side = self.bids if change[0] == 'buy' else self.asks
-                
-                # If the qty becomes 0, we need to get rid of this item in the order book.
-                if size == 0:
-                    orderbook_side.pop(price)
-                else:
-                    # Overwrite entry. The size is the new amount of orders at this price; it is not a delta.
-                    orderbook_side[price] = size
-                
-                best_bid = self.bids.keys()[-1]
-                best_bid_txt = Colors.GREEN + '{0:.2f}'.format(self.bids.keys()[-1]) + Colors.END
 
-                best_ask = self.asks.keys()[0]
-                best_ask_txt = Colors.RED+ '{0:.2f}'.format(self.asks.keys()[0]) + Colors.END
-
-                spread = '{0:.2f}'.format(best_ask - best_bid)
-                spread = Colors.BLUE + spread + Colors.END
+    def on_message(self, msg):
+        msgType = msg['type']
+        if msgType == 'l2update':
+            book = self._book(msg)
+            book.applyChanges(msg['changes'])
+        elif msgType == 'snapshot':
+            book = self._book(msg)
+            book.loadSnapshot(msg)
+        else:
+            return
+        # One update per message, however many changes it had
+        best = book.best()
+        if best != self._lastBest.get(book.product_id):
+            self._lastBest[book.product_id] = best
+            self.on_best_bid_ask({'product_id': book.product_id, 'bid': best[0], 'ask': best[1], 'time': msg.get('time')})
 
+    def on_best_bid_ask(self, update):
+        for callback in self.subscribers:
+            callback(update)
 
-                print('{}\t {}\t{}'.format(best_ask_txt,spread,best_bid_txt))
+    def _book(self, msg):
+        product_id = msg.get('product_id', self.products[0])
+        book = self.books.get(product_id)
+        if book is None:
+            book = self.books[product_id] = Level2Book(product_id)
+        return book
 
 
 if __name__ == '__main__':
     client = Level2OrderbookClient()
-    client.start()
\ No newline at end of file
+    client.subscribe(printBestBidAsk)
+    client.start()
@@ -6,23 +6,197 @@
 
 
 from public_client import PublicClient
-from websocket_client import WebsocketClient
+from websocket_client import WebsocketClient, skeleton_message
+from fixed_point import FixedPoint
+from depth_index import DepthIndex
+from dense_ladder import DenseLadder
+from shared_top import TopOfBookPublisher
+from checkpoint import encode_checkpoint, read_checkpoint, write_checkpoint
 from sortedcontainers import SortedDict
+import os
 import queue
+import time
+from threading import Event, RLock, Thread
 from decimal import Decimal
+from itertools import islice
+
+def _identity(value):
+    return value
+
+
+# This function returns the key an order is stored under: its UUID as a 128-bit int, which takes a third of the
+# memory of the 36 character string
+def orderKey(orderId):
+    if isinstance(orderId, int):
+        return orderId
+    return int(orderId.replace('-', ''), 16)
+
+# This function converts an order key back to the exchange's UUID string
+def orderIdText(key):
+    text = '{:032x}'.format(key)
+    return '{}-{}-{}-{}-{}'.format(text[:8], text[8:12], text[12:16], text[16:20], text[20:])
+
+
+# Checksums are sums of order hashes modulo 2**64, so they can be updated for every change in O(1)
+CHECKSUM_MASK = (1 << 64) - 1
+
+# This function returns the hash of an order that goes into the book checksum
+def orderHash(order):
+    return hash((order.id, order.side == 'buy', order.price, order.size)) & CHECKSUM_MASK
+
+# This function returns the checksum of a book from its order index
+def bookChecksum(orders):
+    return sum(map(orderHash, orders.values())) & CHECKSUM_MASK
+
+
+class Order(object):
+    '''
+    A resting order. id is the order key (see orderKey); price and size are Decimals, or ints in tick mode.
+    Orders can still be read like the dicts they used to be (order['size']).
+    '''
+    __slots__ = ('id', 'side', 'price', 'size')
+
+    def __init__(self, id, side, price, size):
+        self.id = id
+        self.side = side
+        self.price = price
+        self.size = size
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def __repr__(self):
+        return 'Order({}, {}, {}, {})'.format(orderIdText(self.id), self.side, self.price, self.size)
+
+
+class PriceLevel(dict):
+    '''
+    The resting orders at one price, keyed by order key in time priority.
+    The total size of the orders is kept up to date on every change, so the level can be read as an L2 entry.
+    '''
+    __slots__ = ('price', 'size')
+
+    def __init__(self, price=None):
+        super(PriceLevel, self).__init__()
+        # The orders of the level share this price object instead of each holding an equal copy
+        self.price = price
+        self.size = 0
+
+    # The number of orders at this price
+    @property
+    def count(self):
+        return len(self)
 
 class OrderBookFull(WebsocketClient):
-    def __init__(self, product_id='BTC-USD'):
-        super(OrderBookFull,self).__init__(products=product_id,channels=['full'])
-        self.asks = SortedDict()
-        self.bids = SortedDict()
+    def __init__(self, product_id='BTC-USD', use_ticks=False, quote_increment=None, base_increment=None,
+                 checkpoint_path=None, checkpoint_interval=60, dense_ladder=0, **kwargs):
+        '''
+        use_ticks stores prices and sizes as scaled integers instead of Decimals. The scales come from the product's
+        quote_increment/base_increment, which are looked up with PublicClient.get_products unless they are passed in.
+        Prices and sizes are converted back to Decimal by the accessors (getTopBids, getTopAsks, getOrder). A price or
+        size finer than its increment raises ValueError, so pass finer increments for products that have such orders.
+        checkpoint_path writes a checkpoint of the book there every checkpoint_interval seconds, and start() restores
+        the book from it (see restoreCheckpoint).
+        dense_ladder (tick mode only) keeps the levels within that many ticks around each side's touch in an array
+        instead of the sorted dict (see dense_ladder.py).
+        Other keyword arguments are passed on to WebsocketClient (i.e. pipeline=True).
+        '''
+        # Received messages never change the book, so their frames are not decoded (see on_skipped)
+        kwargs.setdefault('skip_types', ['received'])
+        super(OrderBookFull,self).__init__(products=[product_id or 'BTC-USD'],channels=['full'],**kwargs)
+        if dense_ladder and not use_ticks:
+            raise ValueError('dense_ladder requires use_ticks=True')
+        self.dense_ladder = dense_ladder
+        self.asks = self._newSide([], 'sell')
+        self.bids = self._newSide([], 'buy')
+        # Index of every resting order in the book keyed by order key (see orderKey)
+        self.orders = {}
         self._client = PublicClient()
 
         self.sequence = -2
         self.websocketQueue = queue.Queue()
+
+        # Guards the book. Messages are applied and new books are swapped in while holding it
+        self.lock = RLock()
+        # True while live messages are buffered for a snapshot that is being loaded
+        self.resyncing = False
+        self._resyncRunning = False
+        # Set whenever no resync is running, so loadFullOrderBook can wait for one started elsewhere
+        self._resyncDone = Event()
+        self._resyncDone.set()
+        self._resyncOverflow = False
+        # Load snapshots on a worker thread, buffering at most resync_buffer_size messages meanwhile
+        self.resync_in_background = True
+        self.resync_buffer_size = 200000
+        self.resync_retry_delay = 1
+        # perf_counter_ns() when the book stopped being live, for the resync durations in self.metrics
+        self._resyncStarted = None
+
+        # Number of best levels per side tracked for on_top_of_book_changed (0 disables tracking)
+        self.top_levels = 0
+        self._topDirty = True
+        self._lastTop = None
+        # Price of the n-th best level of each side, None if the side has fewer than n levels
+        self._bidBoundary = None
+        self._askBoundary = None
+        # Writes every top of book change to a memory-mapped file for other processes (see publishTopOfBook)
+        self.top_publisher = None
+        # Optional function used instead of a new thread to run a background resync, i.e. an executor's submit
+        self.run_in_background = None
+        # Give up on a snapshot request after this many failed attempts (None retries forever)
+        self.resync_max_attempts = None
+        # Depth indexes of the bids and asks keyed by side (see trackDepth). None when depth queries walk the book
+        self._depth = None
+        # Running checksum of the orders in the book (see trackChecksum). None when it is not kept
+        self._checksum = None
+        # While set (by BookVerifier), processMessage appends (sequence, checksum, message) for every applied message
+        self.checksum_log = None
+
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self._lastCheckpoint = time.monotonic()
+        self._checkpointRunning = False
+
+        self.use_ticks = use_ticks
+        self.quote_increment = quote_increment
+        self.base_increment = base_increment
+        # Functions converting message strings to book values and book values back to Decimal
+        self._parsePrice = self._parseSize = Decimal
+        self._formatPrice = self._formatSize = _identity
+        if use_ticks and quote_increment is not None and base_increment is not None:
+            self._initScales()
     
+    # This method sets up the integer price and size scales for tick mode
+    def _initScales(self):
+        if self.quote_increment is None or self.base_increment is None:
+            # Look up the increments of our product
+            for product in self._client.get_products():
+                if product['id'] == self.get_product_id():
+                    self.quote_increment = self.quote_increment or product['quote_increment']
+                    self.base_increment = self.base_increment or product['base_increment']
+                    break
+            else:
+                raise ValueError('Unknown product {}'.format(self.get_product_id()))
+        # Prices repeat heavily around the spread, so their conversions are cached
+        priceScale = FixedPoint(self.quote_increment, cacheSize=100000)
+        sizeScale = FixedPoint(self.base_increment)
+        self._parsePrice = priceScale.toInt
+        self._parseSize = sizeScale.toInt
+        self._formatPrice = priceScale.toDecimal
+        self._formatSize = sizeScale.toDecimal
+
+
     def get_product_id(self):
         return self.products[0]
+
+    def start(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            try:
+                self.restoreCheckpoint(self.checkpoint_path)
+            except (OSError, ValueError) as e:
+                print("Error: could not restore checkpoint {} ({}). Loading a snapshot".format(self.checkpoint_path, e))
+        super(OrderBookFull, self).start()
+
     def on_open(self):
         self._sequence = -2
         print("-- Subscribed to OrderBook! --\n")
@@ -34,45 +208,181 @@ class OrderBookFull(WebsocketClient):
     def on_message(self,message):
         self.processMessage(message)
 
+    def on_batch_end(self):
+        self.checkTopOfBook()
+        self.checkpointIfDue()
+
+    def on_top_of_book_changed(self,top):
+        '''
+        Called after a batch of messages changed the tracked top levels (see trackTopOfBook). top is a dict with
+        'bids' and 'asks' lists of (price, total size, number of orders), best first, and the book 'sequence'
+        '''
+        pass
+
+    def on_skipped(self,data):
+        # Skipped messages still take up a sequence number, so pass on enough of them to keep the sequence contiguous
+        self.processMessage(skeleton_message(data))
+
+    def on_reconnect(self):
+        # Messages were missed while the connection was down, so reload the book without waiting for a gap
+        print("-- Reconnected after {:.1f} seconds. Re-initializing book --".format(self.last_recovery))
+        self.startResync()
+
     def on_sequence_gap(self, gap_start, gap_end):
-        self.loadFullOrderBook()
         print("Error: messages missing ({} - {}). Re-initializing book".format(gap_start, gap_end))
     
-    
-    
+    # This method fetches and rebuilds the full order book, blocking until it is loaded. If a resync is already running
+    # on another thread it waits for that one instead, so it must not be called while holding self.lock
     def loadFullOrderBook(self):
-        # Reset queue. This queue will hold messages received from websocket while processing rest api request for full order book
-        self.websocketQueue = queue.Queue()
-        
-        # Rest api call for full order book
+        self.startResync(background=False)
+        self._resyncDone.wait()
+
+    # This method starts reloading the full order book from a rest api snapshot
+    def startResync(self, background=None):
+        '''
+        By default the snapshot is downloaded and built into a new book on a worker thread. Meanwhile live messages
+        are buffered in self.websocketQueue and readers keep seeing the last consistent book. Once the new book is
+        ready it is swapped in and the buffered messages are replayed, both while holding self.lock.
+        '''
+        if background is None:
+            background = self.resync_in_background
+        with self.lock:
+            self._markResync()
+            if self._resyncRunning:
+                # The running resync will pick up any messages buffered from now on
+                return
+            self._resyncRunning = True
+            self._resyncDone.clear()
+        if background and self.run_in_background is not None:
+            self.run_in_background(self._resync)
+        elif background:
+            Thread(target=self._resync, daemon=True).start()
+        else:
+            self._resync()
+
+    # This method starts buffering live messages for a resync
+    def _markResync(self):
+        if not self.resyncing:
+            self.resyncing = True
+            self._resyncStarted = time.perf_counter_ns()
+            # Reset queue. This queue will hold messages received from websocket while processing rest api request for full order book
+            self.websocketQueue = queue.Queue(maxsize=self.resync_buffer_size)
+            self._resyncOverflow = False
+
+    def _resync(self):
+        attempts = 0
+        try:
+            while True:
+                try:
+                    response = self._fetchSnapshot()
+                except Exception as e:
+                    attempts += 1
+                    if self.resync_max_attempts is not None and attempts >= self.resync_max_attempts:
+                        raise
+                    print("Error: order book snapshot request failed ({}). Retrying".format(e))
+                    time.sleep(self.resync_retry_delay)
+                    continue
+
+                # Build the new book without holding the lock so readers and the websocket thread are not blocked
+                book = self._buildBook(response)
+
+                with self.lock:
+                    if self._resyncOverflow:
+                        # Messages were dropped while buffering, so this snapshot cannot be brought up to date. Fetch another one
+                        print("Error: resync buffer overflowed. Fetching a new snapshot")
+                        self.websocketQueue = queue.Queue(maxsize=self.resync_buffer_size)
+                        self._resyncOverflow = False
+                        continue
+
+                    # Swap in the new book
+                    self.bids, self.asks, self.orders, self._depth, self._checksum = book
+                    self._topDirty = True
+                    self.sequence = int(response['sequence'])
+                    self.resyncing = False
+
+                    # Playback queued messages, discarding sequence numbers before or equal to the snapshot sequence number.
+                    # If playback hits another gap the remaining messages are buffered again for the next snapshot
+                    buffered = self.websocketQueue.qsize()
+                    for msg in self.getMessageFromQueue(self.websocketQueue):
+                        self.processMessage(msg)
+                    if not self.resyncing:
+                        if self.metrics is not None and self._resyncStarted is not None:
+                            self.metrics.record_resync(time.perf_counter_ns() - self._resyncStarted, buffered)
+                        return
+        finally:
+            with self.lock:
+                self._resyncRunning = False
+                self._resyncDone.set()
+
+    # This method makes the rest api call for the full order book
+    def _fetchSnapshot(self):
+        if self.use_ticks and self._parsePrice is Decimal:
+            self._initScales()
         response = self._client.get_product_order_book(product_id=self.get_product_id(), level=3)
-        
-        # Reset our sorted dicts holding bid and ask orders
-        self.asks = SortedDict()
-        self.bids = SortedDict()
-
-        # Load rest API reponse into asks and bids dicts
-        for bid in response['bids']:
-            self.addToOrderBook({
-                'id':bid[2],
-                'side':'buy',
-                'price':Decimal(bid[0]),
-                'size':Decimal(bid[1])
-            })
-        for ask in response['asks']:
-            self.addToOrderBook({
-                'id': ask[2],
-                'side': 'sell',
-                'price': Decimal(ask[0]),
-                'size': Decimal(ask[1])
-            })
-        
-        # Update the current sequence 
-        self.sequence = response['sequence']
+        if self.recorder:
+            # Keep the snapshot next to the recorded feed so the feed can be replayed offline
+            self.recorder.write_snapshot(response, product_id=self.get_product_id())
+        return response
+
+    # This method returns the container of the price levels of a side, built from (price, level) pairs
+    def _newSide(self, levels, side):
+        if self.dense_ladder:
+            return DenseLadder.fromLevels(levels, self.dense_ladder, high_is_best=(side == 'buy'))
+        return SortedDict(levels)
 
-        # Playback queued messages, discarding sequence numbers before or equal to the snapshot sequence number.
-        for msg in self.getMessageFromQueue(self.websocketQueue):
-            self.processMessage(msg)
+    # This method builds new (bids, asks, orders, depth indexes, checksum) containers from a rest api full order book snapshot
+    def _buildBook(self, response):
+        '''
+        The snapshot rows are grouped by price in a single pass: the exchange returns the rows of a price next to each
+        other (bids in decreasing and asks in increasing price order), so each distinct price string is parsed once and
+        the sorted dicts are built in one step from already sorted levels.
+        '''
+        orders = {}
+        parsePrice = self._parsePrice
+        parseSize = self._parseSize
+        trees = []
+        for side, rows in (('buy', response['bids']), ('sell', response['asks'])):
+            levels = []
+            lastPrice = None
+            for priceText, sizeText, orderId in rows:
+                if priceText != lastPrice:
+                    # First row of a new price, start a new level
+                    lastPrice = priceText
+                    price = parsePrice(priceText)
+                    level = PriceLevel(price)
+                    levels.append((price, level))
+                size = parseSize(sizeText)
+                key = int(orderId.replace('-', ''), 16)
+                order = Order(key, side, price, size)
+                level[key] = order
+                level.size += size
+                orders[key] = order
+            if side == 'buy':
+                # Bids arrive best (highest) first
+                levels.reverse()
+            tree = self._newSide(levels, side)
+            if len(tree) != len(levels):
+                # The rows of some price were not next to each other, so merge the levels that share a price
+                tree = self._newSide([], side)
+                for price, level in levels:
+                    existing = tree.get(price)
+                    if existing is None:
+                        tree[price] = level
+                    else:
+                        existing.update(level)
+                        existing.size += level.size
+                        if self.dense_ladder:
+                            tree.addSize(price, level.size)
+            trees.append(tree)
+        bids, asks = trees
+        depth = None
+        if self._depth is not None:
+            depth = {
+                'buy': DepthIndex.fromLevels(True, ((price, level.size) for price, level in bids.items())),
+                'sell': DepthIndex.fromLevels(False, ((price, level.size) for price, level in asks.items()))
+            }
+        checksum = bookChecksum(orders) if self._checksum is not None else None
+        return bids, asks, orders, depth, checksum
         
     # This method retrieves each message from our queue until it is empty 
     def getMessageFromQueue(self,q):
@@ -84,27 +394,39 @@ class OrderBookFull(WebsocketClient):
 
     # This method proccesses messages from websocket 
     def processMessage(self,message):
-        socketSequence = message.get('sequence',-1)
-        
-        # A sequence less than zero indicates that we are processing a rest API request for the full orderbook
-        if(self.sequence<0):
+        with self.lock:
+            if not self.resyncing:
+                socketSequence = message.get('sequence',-1)
+                if self.sequence == -2:
+                    # A sequence of -2 indicates that we need to perform our initial load of the full orderbook
+                    self._markResync()
+                elif socketSequence <= self.sequence:
+                    # Discard sequence numbers before or equal to the sequence number returned by the rest API request 
+                    return
+                elif socketSequence > self.sequence+1:
+                    # Dropped a message, resync order book
+                    if self.metrics is not None:
+                        self.metrics.record_gap(socketSequence - self.sequence - 1)
+                    self._markResync()
+                    self.on_sequence_gap(self.sequence,socketSequence)
+                else:
+                    self.applyMessage(message)
+                    # Update sequence
+                    self.sequence = socketSequence
+                    if self.checksum_log is not None:
+                        self.checksum_log.append((socketSequence, self._checksum, message))
+                    return
+
             # While we are proccessing rest request, add messages to queue to process later
-            self.websocketQueue.put(message)
+            try:
+                self.websocketQueue.put_nowait(message)
+            except queue.Full:
+                self._resyncOverflow = True
+            if not self._resyncRunning:
+                self.startResync()
 
-        if self.sequence == -2:
-            # A sequence of -2 indicates that we need to perform our initial load of the full orderbook
-            self.loadFullOrderBook()
-            return
-        if self.sequence == -1:
-            # A sequence of -1 indicates that we are in the middle of processinng the rest API request for the full order book
-            return
-        if socketSequence <= self.sequence:
-            # Discard sequence numbers before or equal to the sequence number returned by the rest API request 
-            return
-        elif socketSequence > self.sequence+1:
-            # Dropped a message, resync order book
-            self.on_sequence_gap(self.sequence,socketSequence)
-        
+    # This method applies a message to the order book
+    def applyMessage(self,message):
         # Get message type
         msg_type = message['type']
 
@@ -125,241 +447,434 @@ class OrderBookFull(WebsocketClient):
             self.handleMatch(message)
         elif msg_type == 'change':
             self.change(message)
-        
-        # Update sequence
-        self.sequence = socketSequence
     
     # This method adds an order to our order book
     def addToOrderBook(self, order):
-        order = {
-            'id': order.get('order_id') or order['id'],
-            'side': order['side'],
-            'price': Decimal(order['price']),
-            'size': Decimal(order.get('size') or order['remaining_size'])
-        }
-        if order['side'] == 'buy':
-            # Get list of bid orders at this price
-            bidsAtThisPrice = self.getBidsAtThisPrice(order['price'])
-            if bidsAtThisPrice is None:
-                # If there are no bid orders at this price, start a new list of orders at this price
-                bidsAtThisPrice = [order]
-            else:
-                # If there are bid orders at this price add this order to the list 
-                bidsAtThisPrice.append(order)
-            # Update our sorted dictionary holding all bid orders 
-            self.setBidsAtThisPrice(order['price'],bidsAtThisPrice)
+        # Same as orderKey, inlined on the hot path
+        key = int((order.get('order_id') or order['id']).replace('-', ''), 16)
+        order = Order(key, order['side'], self._parsePrice(order['price']),
+                      self._parseSize(order.get('size') or order['remaining_size']))
+        # Orders at a price are kept in a dict keyed by order key. Dicts preserve insertion order,
+        # so iterating a level still yields its orders in time priority, and removal is O(1)
+        tree = self.bids if order.side == 'buy' else self.asks
+        ordersAtThisPrice = tree.get(order.price)
+        if ordersAtThisPrice is None:
+            # If there are no orders at this price, start a new level at this price
+            ordersAtThisPrice = tree[order.price] = PriceLevel(order.price)
         else:
-            # Get list of ask orders at this price
-            asksAtThisPrice = self.getAsksAtThisPrice(order['price'])
-            if asksAtThisPrice is None:
-                # If there are no ask orders at this price, start a new list of orders at this price
-                asksAtThisPrice = [order]
-            else:
-                # If there are ask orders at this price, add this order to the list 
-                asksAtThisPrice.append(order)
-            # Update our sorted dictionary holding all ask orders 
-            self.setAsksAtThisPrice(order['price'], asksAtThisPrice)
-    
+            order.price = ordersAtThisPrice.price
+        ordersAtThisPrice[order.id] = order
+        ordersAtThisPrice.size += order.size
+        if self.dense_ladder:
+            tree.addSize(order.price, order.size)
+        if self._depth is not None:
+            self._depth[order.side].add(order.price, order.size)
+        if self._checksum is not None:
+            self._checksum = (self._checksum + orderHash(order)) & CHECKSUM_MASK
+        if not self._topDirty:
+            self._levelChanged(order.side, order.price)
+        # Index the order by key so done, match and change messages can find it without scanning its level
+        self.orders[order.id] = order
+
     # This method removes an order from our order book
     def removeFromOrderBook(self,order):
-        price = Decimal(order['price'])
-        if(order['side']=='buy'):
-            bids = self.getBidsAtThisPrice(price)
-            if bids is not None:
-                # Get the list of bids at this prices that do not match the order ID we want to delete
-                bids = [o for o in bids if o['id'] != order ['order_id']]
-                if len(bids) > 0:
-                    # Set bids at this price to the list of bids at this price that are not equal to the order ID we want to remove
-                    self.setBidsAtThisPrice(price, bids)
-                else:
-                    # There are no more bids at this price, so remove it from the dictionary holding all the bids
-                    self.removeBidsAtThisPrice(price)
-        else:
-            # Ask order
-            asks = self.getAsksAtThisPrice(price)
-            if asks is not None:
-                # Get a the list of asks at this prices that do not match the order ID we want to delete
-                asks = [o for o in asks if o['id'] != order['order_id']]
-                if len(asks) > 0:
-                    # Set asks at this price to the list of asks at this price that are not equal to the order ID we want to remove
-                    self.setAsksAtThisPrice(price, asks)
-                else:
-                    # Thare are no more asks at this price so remove it from the dictionary holding all the asks
-                    self.removeAsksAtThisPrice(price)
+        self.removeOrder(int(order['order_id'].replace('-', ''), 16))
+
+    # This method removes the order with the given ID or key from our order book and returns it (None if it is not in the book)
+    def removeOrder(self,orderId):
+        if not isinstance(orderId, int):
+            orderId = orderKey(orderId)
+        order = self.orders.pop(orderId, None)
+        if order is None:
+            # Orders that were never opened (i.e. filled immediately) are not in the book
+            return None
+        tree = self.bids if order.side == 'buy' else self.asks
+        ordersAtThisPrice = tree[order.price]
+        del ordersAtThisPrice[order.id]
+        ordersAtThisPrice.size -= order.size
+        if self.dense_ladder:
+            tree.addSize(order.price, -order.size)
+        if self._depth is not None:
+            self._depth[order.side].add(order.price, -order.size)
+        if self._checksum is not None:
+            self._checksum = (self._checksum - orderHash(order)) & CHECKSUM_MASK
+        if not ordersAtThisPrice:
+            # There are no more orders at this price, so remove the price from the book
+            del tree[order.price]
+        if not self._topDirty:
+            self._levelChanged(order.side, order.price)
+        return order
+
+    # This method returns the order with the given ID as a dict (None if it is not in the book)
+    def getOrder(self,orderId):
+        with self.lock:
+            order = self.orders.get(orderKey(orderId))
+            if order is None:
+                return None
+            # Convert the scaled integer price and size back to Decimal
+            return {'id': orderIdText(order.id), 'side': order.side, 'price': self._formatPrice(order.price),
+                    'size': self._formatSize(order.size)}
     
     # This method updates the order book when a match occurs
     def handleMatch(self,order):
-        price = Decimal(order['price'])
-        size = Decimal(order['size'])
-        if(order['side'] == 'buy'):
-            bids = self.getBidsAtThisPrice(price)
-            if not bids:
-                return
-            for bid in bids:
-                if bid['id'] == order['maker_order_id']:
-                    if(bid['size'] == size):
-                        # Remove this bid from our list of bids at this price because match will result in size of zero
-                        bidsAtThisPrice = [o for o in bids if o['id'] != bid['id']]
-                        if len(bidsAtThisPrice) > 0:
-                            # Set bids at this price to the list of bids at this price that are not equal to the order ID we want to remove
-                            self.setBidsAtThisPrice(price, bidsAtThisPrice)
-                        else:
-                            # There are no more bids at this price, so remove it from the dictionary holding all the bids
-                            self.removeBidsAtThisPrice(price)
-                        break
-                    else:
-                        # Decrement the bid size by size and set bids at this price
-                        bid['size'] -= size
-                        self.setBidsAtThisPrice(price, bids)
-                        break
+        maker = self.orders.get(int(order['maker_order_id'].replace('-', ''), 16))
+        if maker is None:
+            return
+        size = self._parseSize(order['size'])
+        if maker.size == size:
+            # Remove the maker order from the book because the match will result in a size of zero
+            self.removeOrder(maker.id)
         else:
-            asks = self.getAsksAtThisPrice(price)
-            if not asks:
-                return
-            for ask in asks:
-                if ask['id'] == order['maker_order_id']:
-                    if(ask['size'] == size):
-                        # Remove this ask from list of asks at this price because match will result in size of zero
-                        asksAtThisPrice = [o for o in asks if o['id'] != ask['id']]
-                        if len(asksAtThisPrice)>0:
-                            # Set asks at this price to the list of asks at this price that are not equal to the order ID we want to remove
-                            self.setAsksAtThisPrice(price,asksAtThisPrice)
-                        else:
-                            # There are no more asks at this price so remove it from the dictionary holding all the asks
-                            self.removeAsksAtThisPrice(price)
-                        break
-                    else:
-                        # Decrement the asks size by size and set asks at this price
-                        ask['size'] -= size
-                        self.setAsksAtThisPrice(price, asks)
-                        break
+            # Decrement the maker order size by the matched size
+            self.resizeOrder(maker, maker.size - size)
     
     def change(self,order):
         try:
-            new_size = Decimal(order['new_size'])
+            new_size = self._parseSize(order['new_size'])
         except KeyError:
             return
-        try:
+        if order.get('price') is None:
             '''
             Any change message where the price is null indicates that the change message is for a market order.
             Change messages for limit orders will always have a price specified.
             Change massages for market orders are ignored as they are never in the order book.
             '''
-            price = Decimal(order['price'])
-        except KeyError:
             return
-        
-        if order['side'] == 'buy':
-            bids = self.getBidsAtThisPrice(price)
-            if bids is None or not any(o['id'] == order['order_id'] for o in bids):
-                '''
-                If there are no bids at this price or there are no bid orders with matching IDs ignore
-                We receive a change message when there are no matching IDs for received but not yet open orders
-                These can be ignored as they are never in the order book.
-                '''
-                return
-            # Get the index of the matching orderID in our list of bids 
-            index = [b['id'] for b in bids].index(order['order_id'])
-            # Update the size of this order
-            bids[index]['size'] = new_size
-            # Update bid order dict 
-            self.setBidsAtThisPrice(price, bids)
-        else:
-            asks = self.getAsksAtThisPrice(price)
-            if asks is None or not any(o['id'] == order['order_id'] for o in asks):
-                # If there are no asks at this price or there are no asks orders with matching IDs ignore
-                return
-            # Get the index of the matching orderID in our list of asks 
-            index = [a['id'] for a in asks].index(order['order_id'])
-            # Update the size of this order
-            asks[index]['size'] = new_size
-            # Update ask order dict
-            self.setAsksAtThisPrice(price, asks)
+
+        resting = self.orders.get(int(order['order_id'].replace('-', ''), 16))
+        if resting is None:
+            '''
+            If there is no order with a matching ID in the book ignore the message.
+            We receive a change message when there are no matching IDs for received but not yet open orders
+            These can be ignored as they are never in the order book.
+            '''
+            return
+        # Update the size of this order
+        self.resizeOrder(resting, new_size)
+
+    # This method sets the size of a resting order and updates the total size of its price level
+    def resizeOrder(self,order,size):
+        tree = self.bids if order.side == 'buy' else self.asks
+        tree[order.price].size += size - order.size
+        if self.dense_ladder:
+            tree.addSize(order.price, size - order.size)
+        if self._depth is not None:
+            self._depth[order.side].add(order.price, size - order.size)
+        if self._checksum is not None:
+            self._checksum -= orderHash(order)
+            order.size = size
+            self._checksum = (self._checksum + orderHash(order)) & CHECKSUM_MASK
+        order.size = size
+        if not self._topDirty:
+            self._levelChanged(order.side, order.price)
+
+    # This method marks the top of book as changed if the given price is within the tracked top levels of its side
+    def _levelChanged(self,side,price):
+        if side == 'buy':
+            # A boundary of None means the side has fewer levels than we track, so every level is a top level
+            if self._bidBoundary is None or price >= self._bidBoundary:
+                self._topDirty = True
+        elif self._askBoundary is None or price <= self._askBoundary:
+            self._topDirty = True
+
+    # This method starts tracking the best n levels of each side (see on_top_of_book_changed)
+    def trackTopOfBook(self,n):
+        with self.lock:
+            self.top_levels = n
+            self._topDirty = True
+            self._lastTop = None
+
+    # This method publishes the best n levels of each side to a memory-mapped file every time they change
+    def publishTopOfBook(self,path,n=10):
+        '''
+        Other processes read the file with shared_top.TopOfBookReader. Put it under /dev/shm to keep it in memory
+        only. Returns the TopOfBookPublisher, which is closed by the caller once the book is stopped
         '''
-        #implementation to reduce redundancy of if side == buy/sell 
-        tree = self._asks if order['side'] == 'sell' else self._bids
-        node = tree.get(price)
+        with self.lock:
+            self.top_publisher = TopOfBookPublisher(path, n)
+            self.trackTopOfBook(max(n, self.top_levels))
+            return self.top_publisher
 
-        if node is None or not any(o['id'] == order['order_id'] for o in node):
+    # This method raises on_top_of_book_changed if the tracked top levels changed since the last check
+    def checkTopOfBook(self):
+        if not self.top_levels or not self._topDirty:
             return
-        index = [listing['id'] for listing in node].index(order["order_id"])
-        node[index]['size'] = new_size
-        self.setOrdersAtThisPrice(price,node)
+        with self.lock:
+            n = self.top_levels
+            bids = self._topLevels('buy', n)
+            asks = self._topLevels('sell', n)
+            # Changes to levels worse than the n-th level of a side cannot change the top of book
+            self._bidBoundary = bids[-1][0] if len(bids) == n else None
+            self._askBoundary = asks[-1][0] if len(asks) == n else None
+            self._topDirty = False
+            if self._lastTop == (bids, asks):
+                # Levels were touched but ended up the same
+                return
+            self._lastTop = (bids, asks)
+            top = {
+                'bids': [self._formatLevel(level) for level in bids],
+                'asks': [self._formatLevel(level) for level in asks],
+                'sequence': self.sequence
+            }
+            if self.top_publisher is not None:
+                self.top_publisher.publish(top)
+        self.on_top_of_book_changed(top)
+
+    # This method returns (price, total size, number of orders) for the best n prices of a side
+    def _topLevels(self,side,n):
+        return [(price, level.size, len(level)) for price, level in self._bestItems(side, n)]
+
+    # This method returns (price, level) for the best n prices of a side
+    def _bestItems(self,side,n):
+        tree = self.bids if side == 'buy' else self.asks
+        if self.dense_ladder:
+            # The ladder scans its slots from the touch
+            return tree.bestItems(n)
+        # Bids are sorted in increasing order, so the best bids are at the end
+        prices = reversed(tree) if side == 'buy' else iter(tree)
+        return [(price, tree[price]) for price in islice(prices, n)]
+
+    def _formatLevel(self,level):
+        return (self._formatPrice(level[0]), self._formatSize(level[1]), level[2])
+
+    # This method keeps Fenwick tree indexes of both sides so depth queries take logarithmic time
+    def trackDepth(self):
+        '''
+        Depth indexes need integer prices, so the book must use ticks (use_ticks=True). Every level change then also
+        updates the index of its side. Without them cumulative_depth, vwap_for_size and price_for_notional walk the book.
+        '''
+        if not self.use_ticks:
+            raise ValueError('Depth indexes require use_ticks=True')
+        with self.lock:
+            self._depth = {
+                'buy': DepthIndex.fromLevels(True, ((price, level.size) for price, level in self.bids.items())),
+                'sell': DepthIndex.fromLevels(False, ((price, level.size) for price, level in self.asks.items()))
+            }
+
+    # This method keeps a running checksum of every order (id, side, price and size) in the book
+    def trackChecksum(self):
+        '''
+        Every order change updates the checksum in O(1). Two books hold the same orders when their checksums match,
+        which lets BookVerifier check the book against a rest api snapshot without comparing it order by order
         '''
+        with self.lock:
+            self._checksum = bookChecksum(self.orders)
+
+    # This method returns the checksum of the book, None unless trackChecksum was called
+    def checksum(self):
+        with self.lock:
+            return self._checksum
+
+    # This method returns the total size of the best n price levels of a side ('buy' or 'sell')
+    def cumulative_depth(self,side,levels):
+        with self.lock:
+            tree = self.bids if side == 'buy' else self.asks
+            levels = min(levels, len(tree))
+            if levels <= 0:
+                return self._formatSize(self._parseSize(0))
+            if self.dense_ladder:
+                # Sums the ladder's array of level sizes between the touch and the n-th level
+                return self._formatSize(tree.depth(levels))
+            if self._depth is not None:
+                # Price of the n-th best level. Bids are sorted in increasing order, so the best bids are at the end
+                price = tree.peekitem(-levels if side == 'buy' else levels - 1)[0]
+                return self._formatSize(self._depth[side].prefix(price)[0])
+            prices = reversed(tree) if side == 'buy' else iter(tree)
+            return self._formatSize(sum(tree[price].size for price in islice(prices, levels)))
+
+    # This method returns the average price of taking qty from a side ('buy' or 'sell'), None if the side holds less
+    def vwap_for_size(self,side,qty):
+        qty = self._parseSize(qty)
+        if qty <= 0:
+            raise ValueError('qty must be positive')
+        with self.lock:
+            found = self._search(side, qty, 0)
+            if found is None:
+                return None
+            price, size, notional = found
+            # The levels before price are taken completely, the rest of qty comes from the level at price
+            notional += (qty - size) * price
+        # In tick mode notional/qty is in price ticks
+        return self._formatPrice(Decimal(notional) / Decimal(qty))
+
+    # This method returns the worst price reached when spending usd (quote currency) on a side ('buy' or 'sell'),
+    # None if the side holds less
+    def price_for_notional(self,side,usd):
+        # Notionals are price * size, so in tick mode they are scaled by both the price and the size scale
+        target = self._parsePrice(usd) * self._parseSize(1)
+        if target <= 0:
+            raise ValueError('usd must be positive')
+        with self.lock:
+            found = self._search(side, target, 1)
+        if found is None:
+            return None
+        return self._formatPrice(found[0])
 
+    # This method finds the best price of a side at which the cumulative size (field 0) or notional (field 1)
+    # reaches target. It returns (price, size, notional) summed over the better prices, or None
+    def _search(self,side,target,field):
+        if self._depth is not None:
+            return self._depth[side].search(target, field)
+        tree = self.bids if side == 'buy' else self.asks
+        prices = reversed(tree) if side == 'buy' else iter(tree)
+        sums = [0, 0]
+        for price in prices:
+            size = tree[price].size
+            if sums[field] + (size if field == 0 else price * size) >= target:
+                return price, sums[0], sums[1]
+            sums[0] += size
+            sums[1] += price * size
+        return None
 
-    # This method returns a list of bid orders at the given price from our bids dict, whose keys are price
+    # This method returns the total size and the number of orders at the given price
+    def get_level(self,price):
+        with self.lock:
+            price = self._parsePrice(price)
+            level = self.bids.get(price) or self.asks.get(price)
+            if level is None:
+                return (self._formatSize(self._parseSize(0)), 0)
+            return (self._formatSize(level.size), len(level))
+
+    # This method returns (price, total size, number of orders) for the best n price levels of a side ('buy' or 'sell')
+    def get_levels(self,side,n):
+        with self.lock:
+            return [(self._formatPrice(price), self._formatSize(level.size), len(level))
+                    for price, level in self._bestItems(side, n)]
+
+
+    # This method returns the bid orders (keyed by order ID, in time priority) at the given price from our bids dict, whose keys are price
     def getBidsAtThisPrice(self,price):
         return self.bids.get(price)
-    
-    # This method updates our dictionary of bid orders
-    def setBidsAtThisPrice(self,price,bidList):
-        '''
-        This method takes in a list of bids as a parameter, as well as a price.
-        It updates/sets the KEY in our bids dict to the given price and associates the VALUE to the passed in bids list
-        '''
-        self.bids[price] = bidList
-    
-    # This method removes the bid price from our bids dictionary 
-    def removeBidsAtThisPrice(self,price):
-        del self.bids[price]
 
-    # This method returns a list of ask orders at the given price from our asks dict, whose keys are price
+    # This method returns the ask orders (keyed by order ID, in time priority) at the given price from our asks dict, whose keys are price
     def getAsksAtThisPrice(self,price):
         return self.asks.get(price)
-    
-    # This method updates our dictionary of ask orders
-    def setAsksAtThisPrice(self,price,askList):
-        '''
-        This method takes in a list of asks as a parameter, as well as a price.
-        It updates/sets the KEY in our asks dict to the given price and associates the VALUE to the passed in ask list
-        ''' 
-        self.asks[price] = askList
-    
-    # This method removes the ask price from our asks dictionary 
-    def removeAsksAtThisPrice(self,price):
-        del self.asks[price]
-    
 
-    # This method returns a list of the top n bid prices
-    def getTopBids(self,n):
-        # Intialize list to return at the end of method
-        topBids = []
-        numBids = self.bids.keys().__len__()
-        if(n<=numBids):
-            # Traverse our sorted bids dict in reverse order as it is sorted in increasing order and we want the highest bid prices
-            for i in range(numBids-1,numBids-n-1,-1):
-                topBids.append(self.bids.peekitem(i)[0])
-        else:
-            # If there are fewer bid prices than the number requested (n)
-            # Retrieve all the bid prices in bid order book
-            for i in range(numBids-1,-1,-1):
-                topBids.append(self.bids.peekitem(i)[0])
-            # Set the remainder of the top n bids asked for to zero 
-            for i in range(n-numBids):
-                topBids.append(0.00)
-        
-        # Return list of top n bids
-        return topBids
-    
-    # This method returns a list of the top n ask prices
-    def getTopAsks(self,n):
-        # Intialize list to return at the end of method
-        topAsks = []
-        for i in range(n):
+
+    # This method writes a checkpoint on a background thread if checkpoint_interval seconds passed since the last one
+    def checkpointIfDue(self):
+        if not self.checkpoint_path or self._checkpointRunning:
+            return
+        if time.monotonic() - self._lastCheckpoint < self.checkpoint_interval:
+            return
+        self._checkpointRunning = True
+        self._lastCheckpoint = time.monotonic()
+
+        def run():
             try:
-                topAsks.append(self.asks.peekitem(i)[0])
-            except IndexError:
-                '''
-                peekitem(i) would raise an index error if n were greater than the length of the list of keys in our asks dict. 
-                This means there are fewer ask prices than the number requested (n).
-                In this case we append a price of inifinity 
-                '''
-                topAsks.append(float('inf'))
-        return topAsks
+                self.writeCheckpoint()
+            except Exception as e:
+                print("Error: could not write checkpoint {} ({})".format(self.checkpoint_path, e))
+            finally:
+                self._checkpointRunning = False
 
+        if self.run_in_background is not None:
+            self.run_in_background(run)
+        else:
+            Thread(target=run, daemon=True).start()
 
+    # This method writes the book and its sequence to a compact binary checkpoint (see checkpoint.py)
+    def writeCheckpoint(self, path=None):
+        '''
+        Only copying the orders holds the lock; encoding, compressing and writing the file do not.
+        Returns the sequence of the checkpoint, or None if the book is not loaded yet
+        '''
+        path = path or self.checkpoint_path
+        with self.lock:
+            if self.resyncing or self.sequence < 0:
+                return None
+            meta = {
+                'product_id': self.get_product_id(),
+                'sequence': self.sequence,
+                'time': time.time(),
+                'use_ticks': self.use_ticks,
+                'quote_increment': None if self.quote_increment is None else str(self.quote_increment),
+                'base_increment': None if self.base_increment is None else str(self.base_increment)
+            }
+            sides = []
+            for tree in (self.bids, self.asks):
+                sides.append([(price, [(order.id, order.size) for order in level.values()])
+                              for price, level in tree.items()])
+        write_checkpoint(path, encode_checkpoint(meta, sides))
+        return meta['sequence']
+
+    # This method replaces the book with the one saved in a checkpoint and returns the checkpoint's sequence
+    def restoreCheckpoint(self, path, confirm=True):
+        '''
+        With confirm the book also starts a normal resync, which replaces the restored book once the snapshot is
+        loaded; until then readers are served the restored book. Without confirm (i.e. when replaying a recorded
+        feed) the book simply continues from the checkpoint's sequence and only resyncs on a gap.
+        '''
+        meta, sides = read_checkpoint(path)
+        if meta['product_id'] != self.get_product_id():
+            raise ValueError('Checkpoint is for {}, not {}'.format(meta['product_id'], self.get_product_id()))
+        if meta['use_ticks'] != self.use_ticks:
+            raise ValueError('Checkpoint was written with use_ticks={}'.format(meta['use_ticks']))
+        if self.use_ticks:
+            for name in ('quote_increment', 'base_increment'):
+                current = getattr(self, name)
+                if current is not None and Decimal(current) != Decimal(meta[name]):
+                    raise ValueError('Checkpoint {} is {}, not {}'.format(name, meta[name], current))
+            if self._parsePrice is Decimal:
+                self.quote_increment = meta['quote_increment']
+                self.base_increment = meta['base_increment']
+                self._initScales()
 
+        orders = {}
+        trees = []
+        for side, levels in (('buy', sides[0]), ('sell', sides[1])):
+            treeLevels = []
+            for price, levelOrders in levels:
+                level = PriceLevel(price)
+                for key, size in levelOrders:
+                    order = Order(key, side, price, size)
+                    level[key] = order
+                    level.size += size
+                    orders[key] = order
+                treeLevels.append((price, level))
+            trees.append(self._newSide(treeLevels, side))
+        bids, asks = trees
 
-        
+        with self.lock:
+            self.bids, self.asks, self.orders = bids, asks, orders
+            if self._depth is not None:
+                self.trackDepth()
+            if self._checksum is not None:
+                self._checksum = bookChecksum(orders)
+            self._topDirty = True
+            self.sequence = meta['sequence']
+            self.resyncing = False
+            if confirm:
+                self._markResync()
+        return meta['sequence']
 
+    # This method returns a list of the top n bid prices
+    def getTopBids(self,n):
+        with self.lock:
+            if not self._topDirty and n <= self.top_levels and self._lastTop is not None:
+                # The tracked top levels are up to date
+                prices = [level[0] for level in self._lastTop[0][:n]]
+            elif self.dense_ladder:
+                prices = self.bids.bestPrices(n)
+            else:
+                # Traverse our sorted bids dict in reverse order as it is sorted in increasing order and we want the highest bid prices
+                prices = islice(reversed(self.bids), n)
+            topBids = [self._formatPrice(price) for price in prices]
+            # If there are fewer bid prices than the number requested (n) set the remainder to zero
+            topBids.extend([0.00] * (n - len(topBids)))
+            return topBids
+    
+    # This method returns a list of the top n ask prices
+    def getTopAsks(self,n):
+        with self.lock:
+            if not self._topDirty and n <= self.top_levels and self._lastTop is not None:
+                # The tracked top levels are up to date
+                prices = [level[0] for level in self._lastTop[1][:n]]
+            elif self.dense_ladder:
+                prices = self.asks.bestPrices(n)
+            else:
+                prices = islice(self.asks, n)
+            topAsks = [self._formatPrice(price) for price in prices]
+            # If there are fewer ask prices than the number requested (n) set the remainder to infinity
+            topAsks.extend([float('inf')] * (n - len(topAsks)))
+            return topAsks
@@ -0,0 +1,65 @@
+#
+# async_order_book.py
+#
+#
+# Order books fed by AsyncWebsocketClient, so many feeds can share one event loop
+
+import asyncio
+
+from async_websocket_client import AsyncWebsocketClient
+from feed_log import FeedRecorder
+from OrderBookFull import OrderBookFull
+from L2OrderBook import Level2OrderbookClient
+
+
+class AsyncOrderBookFull(AsyncWebsocketClient):
+    '''
+    Maintains an OrderBookFull from the full channel on an asyncio event loop.
+
+    The book itself (self.book) is an ordinary OrderBookFull that is never started. Its level 3 snapshot
+    requests run on the loop's default executor instead of a thread of their own.
+    '''
+
+    def __init__(self, product_id='BTC-USD', use_ticks=False, url="wss://ws-feed.pro.coinbase.com", **kwargs):
+        self.book = OrderBookFull(product_id=product_id, use_ticks=use_ticks)
+        kwargs.setdefault('skip_types', self.book.skip_types)
+        kwargs.setdefault('should_print', False)
+        super(AsyncOrderBookFull, self).__init__(url=url, products=self.book.products, channels=['full'], **kwargs)
+        self.book.metrics = self.metrics
+
+    def start(self):
+        loop = asyncio.get_event_loop()
+        self.book.run_in_background = lambda fn: loop.run_in_executor(None, fn)
+        if self.record_path and self.recorder is None:
+            self.recorder = FeedRecorder(self.record_path)
+        # The book records its snapshots next to our feed
+        self.book.recorder = self.recorder
+        return super(AsyncOrderBookFull, self).start()
+
+    async def on_message(self, msg):
+        self.book.processMessage(msg)
+
+    def on_skipped(self, data):
+        self.book.on_skipped(data)
+
+    def on_batch_end(self):
+        # Lets the book publish top of book changes and write checkpoints
+        self.book.on_batch_end()
+
+    def on_reconnect(self):
+        print("-- Reconnected after {:.1f} seconds. Re-initializing book --".format(self.last_recovery))
+        self.book.startResync()
+
+
+class AsyncLevel2OrderbookClient(AsyncWebsocketClient):
+    '''
+    Maintains a Level 2 book (self.book, a Level2OrderbookClient that is never started) on an asyncio event loop
+    '''
+
+    def __init__(self, products=['BTC-USD'], url="wss://ws-feed.pro.coinbase.com", **kwargs):
+        self.book = Level2OrderbookClient(products=products)
+        kwargs.setdefault('should_print', False)
+        super(AsyncLevel2OrderbookClient, self).__init__(url=url, products=products, channels=['level2'], **kwargs)
+
+    async def on_message(self, msg):
+        self.book.on_message(msg)
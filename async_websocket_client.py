@@ -0,0 +1,174 @@
+#
+# async_websocket_client.py
+#
+#
+# asyncio variant of WebsocketClient. Requires the websockets package
+
+import asyncio
+import json
+import time
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+from websocket_client import WebsocketClient, _STABLE_SECONDS
+from feed_log import FeedRecorder
+from mongo_sink import MongoSink
+
+
+class AsyncWebsocketClient(WebsocketClient):
+    """Receives the Coinbase websocket feed on an asyncio event loop.
+
+    It takes the same arguments as WebsocketClient. Instead of a thread per
+    socket, `start()` schedules the feed as a task on the running loop, so one
+    loop can serve many feeds. `on_open`, `on_message` and `on_close` are
+    coroutines. `on_skipped`, `on_batch_end`, `on_reconnect` and `on_error`
+    stay plain methods. Every message is its own batch. Lost connections are
+    reopened like WebsocketClient's; websockets' own pings are the watchdog.
+
+    Example::
+        async def main():
+            client = AsyncWebsocketClient(products=['BTC-USD'])
+            client.start()
+            await asyncio.sleep(10)
+            await client.close()
+    """
+
+    def __init__(self, *args, **kwargs):
+        if websockets is None:
+            raise ImportError('AsyncWebsocketClient requires the websockets package')
+        super(AsyncWebsocketClient, self).__init__(*args, **kwargs)
+        self.task = None
+
+    def start(self):
+        if self.record_path and self.recorder is None:
+            self.recorder = FeedRecorder(self.record_path)
+        if self.mongo_collection and self.mongo_sink is None:
+            self.mongo_sink = MongoSink(self.mongo_collection)
+            self._owns_mongo_sink = True
+        self.stop = False
+        self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def run(self):
+        """Connect, subscribe and handle messages until `close()` is called, reconnecting when the connection is lost."""
+        await self.on_open()
+        attempts = 0
+        lost = None
+        try:
+            while not self.stop:
+                try:
+                    await self._connect()
+                except Exception as e:
+                    self.on_error(e)
+                    attempts += 1
+                    if lost is None:
+                        lost = time.monotonic()
+                    if not await self._wait_to_reconnect_async(attempts):
+                        return
+                    continue
+                if lost is not None:
+                    self._recovered(lost, attempts)
+                    lost = None
+                connected = time.monotonic()
+                try:
+                    await self._listen()
+                except Exception as e:
+                    self.on_error(e)
+                if self.ws is not None:
+                    await self.ws.close()
+                if self.stop:
+                    return
+                lost = time.monotonic()
+                # Back off from connections dropped straight away like from failed connects (see WebsocketClient)
+                attempts = 0 if lost - connected >= _STABLE_SECONDS else attempts + 1
+                if self.metrics is not None:
+                    self.metrics.record_disconnect()
+                if not await self._wait_to_reconnect_async(attempts):
+                    return
+        finally:
+            await self._disconnect()
+
+    async def _wait_to_reconnect_async(self, attempts):
+        delay = self._reconnect_delay(attempts)
+        if delay is None:
+            return False
+        until = time.monotonic() + delay
+        while not self.stop and time.monotonic() < until:
+            await asyncio.sleep(min(0.1, max(0, until - time.monotonic())))
+        return not self.stop
+
+    async def _connect(self):
+        sub_params = self._subscribe_params()
+        # websockets answers pings and sends its own keepalive pings. It closes the connection when a ping is not
+        # answered within heartbeat_timeout seconds
+        self.ws = await websockets.connect(self.url, max_size=None, ping_interval=self.ping_interval,
+                                           ping_timeout=self.heartbeat_timeout)
+        await self.ws.send(json.dumps(sub_params))
+
+    async def _listen(self):
+        async for data in self.ws:
+            if self.stop:
+                break
+            if self.recorder:
+                self.recorder.write_frame(data)
+            metrics = self.metrics
+            try:
+                start = time.perf_counter_ns() if metrics is not None else 0
+                msg = self.decode_frame(data)
+            except ValueError as e:
+                self.on_error(e, data)
+                continue
+            if metrics is None:
+                if msg is not None:
+                    await self.on_message(msg)
+                self.on_batch_end()
+                continue
+            decoded = time.perf_counter_ns()
+            if msg is None:
+                metrics.record_message('skipped', decoded - start)
+            else:
+                await self.on_message(msg)
+                metrics.record_message(msg.get('type'), decoded - start, time.perf_counter_ns() - decoded,
+                                       msg.get('time'))
+            self._batch_end_timed()
+
+    async def _disconnect(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+        if self._owns_mongo_sink:
+            # Write out whatever is still buffered without blocking the loop
+            sink = self.mongo_sink
+            self.mongo_sink = None
+            self._owns_mongo_sink = False
+            await asyncio.get_event_loop().run_in_executor(None, sink.close)
+        elif self.mongo_sink:
+            self.mongo_sink.flush()
+        await self.on_close()
+
+    async def close(self):
+        self.stop = True
+        if self.ws is not None:
+            # Closing the socket ends the `async for` in _listen
+            await self.ws.close()
+        if self.task is not None:
+            await self.task
+
+    async def on_open(self):
+        if self.should_print:
+            print("-- Subscribed! --\n")
+
+    async def on_close(self):
+        if self.should_print:
+            print("\n-- Socket Closed --")
+
+    async def on_message(self, msg):
+        if self.should_print:
+            print(msg)
+        if self.mongo_sink:  # dump JSON to given mongo collection
+            self.mongo_sink.put(msg)
@@ -0,0 +1,238 @@
+#
+# benchmark.py
+#
+#
+# Offline benchmarks for the order book. Run with: python benchmark.py [--help]
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from L2OrderBook import Level2OrderbookClient
+from OrderBookFull import OrderBookFull
+from replay import ReplayClient
+from workload import FullChannelWorkload
+
+
+# This function returns the q-th quantile (0 <= q <= 1) of an already sorted list
+def percentile(values, q):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# This function prints throughput and latency percentiles for a list of per-call nanosecond timings
+def report(name, timings, peakBytes=None):
+    timings = sorted(timings)
+    total = sum(timings)
+    line = '{:36} {:>12,.0f} ops/s   p50 {:>7.2f}us   p99 {:>8.2f}us   p999 {:>8.2f}us'.format(
+        name, len(timings) / (total / 1e9) if total else 0,
+        percentile(timings, 0.5) / 1e3, percentile(timings, 0.99) / 1e3, percentile(timings, 0.999) / 1e3)
+    if peakBytes is not None:
+        line += '   peak {:8.1f}MB'.format(peakBytes / 1e6)
+    print(line)
+
+
+# This function returns a book that loads the given snapshot inline, without any network access
+def offlineBook(snapshot, use_ticks=False, **kwargs):
+    book = OrderBookFull(use_ticks=use_ticks, quote_increment='0.01', base_increment='0.00000001', **kwargs)
+    book._client = ReplayClient([(0, snapshot)])
+    book.resync_in_background = False
+    return book
+
+
+# This function returns (result, peak traced memory in bytes) of calling fn
+def tracePeak(fn):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# This function loads the snapshot one row at a time through addToOrderBook, like the book used to
+def loadPerRow(book, snapshot):
+    for bid in snapshot['bids']:
+        book.addToOrderBook({'id': bid[2], 'side': 'buy', 'price': bid[0], 'size': bid[1]})
+    for ask in snapshot['asks']:
+        book.addToOrderBook({'id': ask[2], 'side': 'sell', 'price': ask[0], 'size': ask[1]})
+
+
+# This function times going from a decoded snapshot to a ready book, per row and through loadFullOrderBook
+def benchmarkSnapshotLoad(snapshot, use_ticks=False, repeat=3):
+    rowCount = len(snapshot['bids']) + len(snapshot['asks'])
+    mode = 'ticks' if use_ticks else 'decimal'
+
+    def perRow():
+        book = offlineBook(snapshot, use_ticks)
+        loadPerRow(book, snapshot)
+        return book
+
+    def bulk():
+        book = offlineBook(snapshot, use_ticks)
+        book.loadFullOrderBook()
+        return book
+
+    for name, fn in (('per-row', perRow), ('loadFullOrderBook', bulk)):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            fn()
+            timings.append(time.perf_counter_ns() - start)
+        book, peak = tracePeak(fn)
+        best = min(timings)
+        print('{:36} {:>12,.0f} rows/s   best {:8.3f}s   peak {:8.1f}MB'.format(
+            'snapshot {} {}'.format(name, mode), rowCount / (best / 1e9), best / 1e9, peak / 1e6))
+
+
+# This function times every processMessage call over the messages, then reruns them to measure peak memory
+def benchmarkProcessMessage(snapshot, messages, use_ticks=False, dense_ladder=0):
+    mode = 'ticks' if use_ticks else 'decimal'
+    if dense_ladder:
+        mode += ' dense {}'.format(dense_ladder)
+    book = offlineBook(snapshot, use_ticks, dense_ladder=dense_ladder)
+    book.loadFullOrderBook()
+    clock = time.perf_counter_ns
+    processMessage = book.processMessage
+    timings = []
+    append = timings.append
+    gc.collect()
+    for message in messages:
+        start = clock()
+        processMessage(message)
+        append(clock() - start)
+
+    def run():
+        traced = offlineBook(snapshot, use_ticks, dense_ladder=dense_ladder)
+        traced.loadFullOrderBook()
+        for message in messages:
+            traced.processMessage(message)
+
+    unused, peak = tracePeak(run)
+    report('processMessage {}'.format(mode), timings, peak)
+    return book
+
+
+# This function prints the memory the book holds per resting order after loading the snapshot and after every
+# chunk of messages, to show whether it stays flat over a long run
+def benchmarkOrderMemory(snapshot, messages, use_ticks=False, chunks=4):
+    mode = 'ticks' if use_ticks else 'decimal'
+    gc.collect()
+    # The snapshot (and the messages) already exist, so only what the book allocates is traced
+    tracemalloc.start()
+    try:
+        book = offlineBook(snapshot, use_ticks)
+        book.loadFullOrderBook()
+        points = [('snapshot', tracemalloc.get_traced_memory()[0], len(book.orders))]
+        step = max(1, len(messages) // chunks)
+        for start in range(0, len(messages), step):
+            for message in messages[start:start + step]:
+                book.processMessage(message)
+            gc.collect()
+            points.append(('+{:,} messages'.format(start + step), tracemalloc.get_traced_memory()[0], len(book.orders)))
+    finally:
+        tracemalloc.stop()
+    for name, current, orders in points:
+        print('{:36} {:>12,.0f} bytes/order   {:,} orders   {:8.1f}MB'.format(
+            'memory {} {}'.format(mode, name), current / orders if orders else 0, orders, current / 1e6))
+
+
+# This function times getTopBids/getTopAsks on a loaded book
+def benchmarkTopOfBook(book, n=5, calls=100000):
+    mode = 'ticks' if book.use_ticks else 'decimal'
+    if book.dense_ladder:
+        mode += ' dense {}'.format(book.dense_ladder)
+    clock = time.perf_counter_ns
+    for name, fn in (('getTopBids', book.getTopBids), ('getTopAsks', book.getTopAsks)):
+        timings = []
+        for _ in range(calls):
+            start = clock()
+            fn(n)
+            timings.append(clock() - start)
+        report('{}({}) {}'.format(name, n, mode), timings)
+
+
+# This function times the depth queries on a loaded book, once walking the book and once with depth indexes
+def benchmarkDepthQueries(book, levels=100, calls=20000):
+    clock = time.perf_counter_ns
+    # Ask for half of the side so the queries reach deep into the book
+    qty = book.cumulative_depth('sell', len(book.asks)) / 2
+    usd = qty * book.get_levels('sell', 1)[0][0]
+    for mode in ('walk', 'index'):
+        if mode == 'index':
+            book.trackDepth()
+        for name, fn in (('cumulative_depth', lambda: book.cumulative_depth('buy', levels)),
+                         ('vwap_for_size', lambda: book.vwap_for_size('sell', qty)),
+                         ('price_for_notional', lambda: book.price_for_notional('sell', usd))):
+            timings = []
+            for _ in range(calls):
+                start = clock()
+                fn()
+                timings.append(clock() - start)
+            report('{} {}'.format(name, mode), timings)
+
+
+# This function times loading a level2 snapshot and applying l2update messages with Level2OrderbookClient
+def benchmarkLevel2(snapshot, updates, repeat=3):
+    rowCount = len(snapshot['bids']) + len(snapshot['asks'])
+    timings = []
+    for _ in range(repeat):
+        client = Level2OrderbookClient(should_print=False)
+        start = time.perf_counter_ns()
+        client.on_message(snapshot)
+        timings.append(time.perf_counter_ns() - start)
+    best = min(timings)
+    print('{:36} {:>12,.0f} rows/s   best {:8.3f}s'.format('level2 snapshot', rowCount / (best / 1e9), best / 1e9))
+
+    events = []
+    client.subscribe(events.append)
+    clock = time.perf_counter_ns
+    on_message = client.on_message
+    timings = []
+    append = timings.append
+    gc.collect()
+    for update in updates:
+        start = clock()
+        on_message(update)
+        append(clock() - start)
+    report('level2 l2update', timings)
+    changes = sum(len(update['changes']) for update in updates)
+    print('{:36} {:,} changes, {:,} best bid/ask updates'.format('', changes, len(events)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Order book benchmarks on a synthetic full channel workload')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--depth', type=int, default=2000, help='price levels per side')
+    parser.add_argument('--orders-per-level', type=int, default=50)
+    parser.add_argument('--cancel-ratio', type=float, default=0.45)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--levels', type=int, default=5, help='n passed to getTopBids/getTopAsks')
+    parser.add_argument('--dense-ladder', type=int, default=256, help='window width in ticks for the dense ladder run')
+    parser.add_argument('--level2-updates', type=int, default=100000, help='l2update messages for the level2 benchmark')
+    args = parser.parse_args()
+
+    workload = FullChannelWorkload(seed=args.seed, depth=args.depth, ordersPerLevel=args.orders_per_level,
+                                   cancelRatio=args.cancel_ratio)
+    snapshot = workload.snapshot()
+    messages = workload.messages(args.messages)
+    print('{:,} snapshot orders, {:,} messages'.format(len(snapshot['bids']) + len(snapshot['asks']), len(messages)))
+
+    for use_ticks in (False, True):
+        benchmarkSnapshotLoad(snapshot, use_ticks=use_ticks)
+        book = benchmarkProcessMessage(snapshot, messages, use_ticks=use_ticks)
+        benchmarkTopOfBook(book, n=args.levels)
+        benchmarkOrderMemory(snapshot, messages, use_ticks=use_ticks)
+    # Depth indexes need ticks, so book is the tick mode book here
+    benchmarkDepthQueries(book)
+    if args.dense_ladder:
+        denseBook = benchmarkProcessMessage(snapshot, messages, use_ticks=True, dense_ladder=args.dense_ladder)
+        benchmarkTopOfBook(denseBook, n=args.levels)
+
+    # A separate workload, since the level2 messages are generated from its matching engine events
+    workload = FullChannelWorkload(seed=args.seed, depth=args.depth, ordersPerLevel=args.orders_per_level,
+                                   cancelRatio=args.cancel_ratio)
+    benchmarkLevel2(workload.level2Snapshot(), workload.level2Updates(args.level2_updates))
@@ -0,0 +1,81 @@
+#
+# book_manager.py
+#
+#
+# Maintains full order books for many products over a single websocket connection
+
+import os
+
+from OrderBookFull import OrderBookFull
+from public_client import PublicClient
+from websocket_client import WebsocketClient, skeleton_message
+from feed_log import FeedRecorder
+
+
+class BookManager(WebsocketClient):
+    '''
+    Subscribes to the full channel for every product on one connection and routes each message by its product_id
+    to that product's OrderBookFull. The books are never started themselves; each one keeps its own sequence
+    and resyncs on its own when it sees a gap.
+    '''
+
+    def __init__(self, product_ids, use_ticks=False, **kwargs):
+        product_ids = list(product_ids)
+        # Received messages never change a book, so their frames are not decoded (see on_skipped)
+        kwargs.setdefault('skip_types', ['received'])
+        super(BookManager, self).__init__(products=product_ids, channels=['full'], **kwargs)
+        self.books = {}
+        # One rest api client for every book, so they share the rate limit and a single products lookup
+        self.client = PublicClient(cache=True)
+        for product_id in product_ids:
+            self.books[product_id] = OrderBookFull(product_id=product_id, use_ticks=use_ticks)
+            self.books[product_id]._client = self.client
+            # Gaps and resyncs of every book are counted in our metrics
+            self.books[product_id].metrics = self.metrics
+
+    # This method returns the order book of a product
+    def book(self, product_id):
+        return self.books[product_id]
+
+    def start(self):
+        if self.record_path and self.recorder is None:
+            self.recorder = FeedRecorder(self.record_path)
+        # The books record their snapshots next to our feed
+        for book in self.books.values():
+            book.recorder = self.recorder
+            if book.checkpoint_path and os.path.exists(book.checkpoint_path):
+                try:
+                    book.restoreCheckpoint(book.checkpoint_path)
+                except (OSError, ValueError) as e:
+                    print("Error: could not restore checkpoint {} ({})".format(book.checkpoint_path, e))
+        super(BookManager, self).start()
+
+    def on_open(self):
+        print("-- Subscribed to {} order books! --\n".format(len(self.books)))
+
+    def on_close(self):
+        print("\n-- BookManager Socket Closed! --")
+
+    def on_reconnect(self):
+        print("-- Reconnected after {:.1f} seconds. Re-initializing {} order books --".format(self.last_recovery,
+                                                                                          len(self.books)))
+        for book in self.books.values():
+            book.startResync()
+
+    def on_message(self, message):
+        self.processMessage(message)
+
+    def on_batch_end(self):
+        # Lets each book publish top of book changes and write checkpoints
+        for book in self.books.values():
+            book.on_batch_end()
+
+    def on_skipped(self, data):
+        # Skipped messages still take up a sequence number in their product's book
+        self.processMessage(skeleton_message(data))
+
+    # This method passes a message to the book of its product
+    def processMessage(self, message):
+        book = self.books.get(message.get('product_id'))
+        if book is not None:
+            book.processMessage(message)
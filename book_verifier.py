@@ -0,0 +1,158 @@
+#
+# book_verifier.py
+#
+#
+# Checks a live OrderBookFull against level 3 rest api snapshots by comparing checksums
+
+import threading
+import time
+
+from OrderBookFull import OrderBookFull, orderIdText
+
+
+class BookVerifier(object):
+    """Periodically verifies that a book matches the exchange's.
+
+    Every `interval` seconds a level 3 snapshot is fetched and built on a
+    background thread. Its checksum is compared with the book's checksum at
+    the snapshot's sequence, which the book records while a check is in
+    flight (see OrderBookFull.checksum_log). The book itself is never copied
+    or rebuilt when they match. Only on a mismatch is the snapshot brought up
+    to the book's sequence with the recorded messages and diffed with the
+    book, order by order. The diff goes to `on_mismatch`, which by default
+    prints it and resyncs the book.
+
+    Args:
+        book (OrderBookFull): The book to verify. Its checksum is tracked from now on.
+        interval (Optional[float]): Seconds between checks.
+        max_wait (Optional[float]): Most seconds to wait for the book to reach a snapshot's sequence.
+
+    """
+
+    def __init__(self, book, interval=300, max_wait=30):
+        self.book = book
+        self.interval = interval
+        self.max_wait = max_wait
+        book.trackChecksum()
+
+        self.checks = 0
+        self.matches = 0
+        self.mismatches = 0
+        self.inconclusive = 0
+        self.last_sequence = None
+        self.last_seconds = 0.0
+        self.last_diff = None
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        return {
+            'checks': self.checks,
+            'matches': self.matches,
+            'mismatches': self.mismatches,
+            'inconclusive': self.inconclusive,
+            'last_sequence': self.last_sequence,
+            'last_seconds': self.last_seconds,
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.verify()
+            except Exception as e:
+                print('BookVerifier: check failed - {}'.format(e))
+
+    def verify(self):
+        """Run one check. Returns True if the book matched, False on a mismatch and None if it was inconclusive."""
+        book = self.book
+        start = time.monotonic()
+        self.checks += 1
+        with book.lock:
+            if book.resyncing or book.sequence < 0:
+                self.inconclusive += 1
+                return None
+            # Record the checksum after every message from now on, so it is known at the snapshot's sequence
+            logStart = book.sequence
+            log = book.checksum_log = [(logStart, book._checksum, None)]
+        try:
+            response = book._client.get_product_order_book(product_id=book.get_product_id(), level=3)
+            snapshotSequence = int(response['sequence'])
+            bids, asks, orders, depth, expected = book._buildBook(response)
+
+            # Wait for the book to catch up with the snapshot
+            deadline = time.monotonic() + self.max_wait
+            while book.sequence < snapshotSequence and time.monotonic() < deadline and not book.resyncing:
+                time.sleep(0.05)
+
+            with book.lock:
+                book.checksum_log = None
+                index = snapshotSequence - logStart
+                if book.resyncing or not 0 <= index < len(log) or log[index][0] != snapshotSequence:
+                    # The snapshot is older than the recording, the book did not get there or it was reloaded
+                    self.inconclusive += 1
+                    return None
+                actual = log[index][1]
+                self.last_sequence = snapshotSequence
+                if actual == expected:
+                    self.matches += 1
+                    return True
+                # Copy the book only now that it is known to be wrong
+                live = dict((key, (order.side, order.price, order.size)) for key, order in book.orders.items())
+                liveSequence = book.sequence
+            self.mismatches += 1
+            later = [entry[2] for entry in log if snapshotSequence < entry[0] <= liveSequence]
+            self.last_diff = self._diff(response, bids, asks, orders, later, live, liveSequence)
+        finally:
+            with book.lock:
+                if book.checksum_log is log:
+                    book.checksum_log = None
+            self.last_seconds = time.monotonic() - start
+        self.on_mismatch(self.last_diff)
+        return False
+
+    # This method brings the snapshot up to the book's sequence and returns the differences between the two
+    def _diff(self, response, bids, asks, orders, messages, live, liveSequence):
+        book = self.book
+        shadow = OrderBookFull(product_id=book.get_product_id(), use_ticks=book.use_ticks,
+                               quote_increment=book.quote_increment, base_increment=book.base_increment)
+        shadow.bids, shadow.asks, shadow.orders = bids, asks, orders
+        for message in messages:
+            shadow.applyMessage(message)
+
+        expected = dict((key, (order.side, order.price, order.size)) for key, order in shadow.orders.items())
+        formatPrice = book._formatPrice
+        formatSize = book._formatSize
+
+        def describe(key, state):
+            side, price, size = state
+            return {'id': orderIdText(key), 'side': side, 'price': formatPrice(price), 'size': formatSize(size)}
+
+        return {
+            'snapshot_sequence': int(response['sequence']),
+            'sequence': liveSequence,
+            # Orders the exchange has that the book is missing
+            'missing': [describe(key, expected[key]) for key in expected.keys() - live.keys()],
+            # Orders in the book the exchange does not have
+            'unexpected': [describe(key, live[key]) for key in live.keys() - expected.keys()],
+            # Orders whose price or size differ, as (book, exchange)
+            'different': [(describe(key, live[key]), describe(key, expected[key]))
+                          for key in live.keys() & expected.keys() if live[key] != expected[key]],
+        }
+
+    def on_mismatch(self, diff):
+        print('BookVerifier: book differs from the exchange at sequence {}: {} missing, {} unexpected, {} different '
+              'orders. Re-initializing book'.format(diff['sequence'], len(diff['missing']), len(diff['unexpected']),
+                                                    len(diff['different'])))
+        self.book.startResync()
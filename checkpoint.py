@@ -0,0 +1,116 @@
+#
+# checkpoint.py
+#
+#
+# Compact binary checkpoints of a full order book, so a book can be restored without a rest api snapshot
+
+import json
+import os
+import struct
+import zlib
+from array import array
+from decimal import Decimal
+
+_MAGIC = b'CBBOOK2\0'
+_LENGTH = struct.Struct('<I')
+
+
+def _column(values, use_ticks):
+    # Tick mode values are ints and are stored as int64s, Decimals are stored as text
+    if use_ticks:
+        return array('q', values).tobytes()
+    return '\n'.join(map(str, values)).encode('ascii')
+
+
+def _readColumn(data, use_ticks):
+    if use_ticks:
+        values = array('q')
+        values.frombytes(data)
+        return values.tolist()
+    if not data:
+        return []
+    return [Decimal(value) for value in data.decode('ascii').split('\n')]
+
+
+def _orderKeys(data):
+    # Order keys are 128-bit ints stored back to back as 16 big-endian bytes
+    fromBytes = int.from_bytes
+    return [fromBytes(data[i:i + 16], 'big') for i in range(0, len(data), 16)]
+
+
+def encode_checkpoint(meta, sides):
+    """Serialize a book.
+
+    Args:
+        meta (dict): JSON serializable book details (sequence, product_id, use_ticks, increments).
+        sides (list): For the bids and then the asks, a list of (price, [(order key, size), ...]) levels.
+            Order keys are the 128-bit ints of OrderBookFull.orderKey.
+
+    Returns:
+        bytes: The checkpoint.
+    """
+    use_ticks = meta['use_ticks']
+    chunks = []
+    for levels in sides:
+        prices = []
+        counts = []
+        ids = []
+        sizes = []
+        for price, orders in levels:
+            prices.append(price)
+            counts.append(len(orders))
+            for key, size in orders:
+                ids.append(key.to_bytes(16, 'big'))
+                sizes.append(size)
+        chunks.extend([_column(prices, use_ticks), array('I', counts).tobytes(), b''.join(ids),
+                       _column(sizes, use_ticks)])
+    body = [json.dumps(meta).encode('utf-8')] + chunks
+    data = b''.join(_LENGTH.pack(len(chunk)) + chunk for chunk in body)
+    return _MAGIC + zlib.compress(data, 1)
+
+
+def decode_checkpoint(data):
+    """Return (meta, sides) from a checkpoint written by encode_checkpoint."""
+    if data[:len(_MAGIC)] != _MAGIC:
+        raise ValueError('Not an order book checkpoint')
+    data = zlib.decompress(data[len(_MAGIC):])
+    chunks = []
+    offset = 0
+    while offset < len(data):
+        length, = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        chunks.append(data[offset:offset + length])
+        offset += length
+    meta = json.loads(chunks[0])
+    use_ticks = meta['use_ticks']
+    sides = []
+    for i in (1, 5):
+        prices = _readColumn(chunks[i], use_ticks)
+        counts = array('I')
+        counts.frombytes(chunks[i + 1])
+        ids = _orderKeys(chunks[i + 2])
+        sizes = _readColumn(chunks[i + 3], use_ticks)
+        levels = []
+        start = 0
+        for price, count in zip(prices, counts):
+            end = start + count
+            levels.append((price, list(zip(ids[start:end], sizes[start:end]))))
+            start = end
+        sides.append(levels)
+    return meta, sides
+
+
+def write_checkpoint(path, data):
+    """Write checkpoint bytes to path, replacing any older checkpoint atomically."""
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def read_checkpoint(path):
+    """Return (meta, sides) of the checkpoint at path."""
+    with open(path, 'rb') as f:
+        return decode_checkpoint(f.read())
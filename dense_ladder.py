@@ -0,0 +1,326 @@
+#
+# dense_ladder.py
+#
+#
+# Price levels of one side of the book kept in an array indexed by tick offset near the touch
+
+from itertools import chain, islice
+
+from sortedcontainers import SortedDict
+
+
+class DenseLadder(object):
+    '''
+    Drop-in replacement for the SortedDict of price levels of one book side, for integer (tick) prices.
+
+    Levels within `width` ticks around the touch live in a list indexed by their offset from `anchor`, so adding,
+    finding and removing them is plain indexing instead of a sorted insert or delete. Levels outside the window are
+    kept in a SortedDict. When the touch leaves the window, the window is recentered on it and the levels are moved
+    between the list and the SortedDict.
+
+    Next to the levels the window keeps a bytearray marking the occupied slots and a list of the levels' total sizes,
+    so the best levels are found with bytearray.find from the touch and their depth is summed over a slice. The book
+    reports every change of a level's size with addSize. The touch is always in the window, so the far levels are
+    all worse than the window's levels.
+
+    high_is_best is True for bids (the touch is the highest price) and False for asks. Keys iterate in increasing
+    order like SortedDict.
+    '''
+
+    def __init__(self, width=1024, high_is_best=False):
+        self.width = width
+        self.high_is_best = high_is_best
+        self.anchor = None
+        self.slots = [None] * width
+        # 1 for the occupied slots, and the total size of each slot's level (0 for empty slots)
+        self.present = bytearray(width)
+        self.sizes = [0] * width
+        # Number of levels in the window and the lowest/highest occupied slot (None if the window is empty)
+        self.occupied = 0
+        self.lowSlot = None
+        self.highSlot = None
+        self.far = SortedDict()
+        self.recenters = 0
+
+    @classmethod
+    def fromLevels(cls, levels, width=1024, high_is_best=False):
+        '''Build a ladder from (price, level) pairs.'''
+        ladder = cls(width, high_is_best)
+        levels = list(levels)
+        if levels:
+            prices = [price for price, level in levels]
+            ladder._center(max(prices) if high_is_best else min(prices))
+        for price, level in levels:
+            ladder[price] = level
+        return ladder
+
+    # This method places the window so that price is in its middle
+    def _center(self, price):
+        self.anchor = price - self.width // 2
+
+    # This method moves the window so it is centered on price, moving levels between the window and the far levels
+    def _recenter(self, price):
+        self.recenters += 1
+        slots = self.slots
+        if self.occupied:
+            for i in range(self.lowSlot, self.highSlot + 1):
+                level = slots[i]
+                if level is not None:
+                    self.far[self.anchor + i] = level
+                    slots[i] = None
+            self.present = bytearray(self.width)
+            self.sizes = [0] * self.width
+        self.occupied = 0
+        self.lowSlot = self.highSlot = None
+        self._center(price)
+        anchor = self.anchor
+        inWindow = list(self.far.irange(anchor, anchor + self.width - 1))
+        for key in inWindow:
+            self._setSlot(key - anchor, self.far.pop(key))
+
+    def _setSlot(self, i, level):
+        if self.slots[i] is None:
+            self.occupied += 1
+            self.present[i] = 1
+            if self.lowSlot is None or i < self.lowSlot:
+                self.lowSlot = i
+            if self.highSlot is None or i > self.highSlot:
+                self.highSlot = i
+        self.slots[i] = level
+        self.sizes[i] = level.size
+
+    # This method returns the best price of the side, None if it is empty
+    def _best(self):
+        far = self.far
+        if self.high_is_best:
+            candidates = [far.peekitem(-1)[0]] if far else []
+            if self.occupied:
+                candidates.append(self.anchor + self.highSlot)
+            return max(candidates) if candidates else None
+        candidates = [far.peekitem(0)[0]] if far else []
+        if self.occupied:
+            candidates.append(self.anchor + self.lowSlot)
+        return min(candidates) if candidates else None
+
+    def get(self, price, default=None):
+        i = price - self.anchor if self.anchor is not None else -1
+        if 0 <= i < self.width:
+            level = self.slots[i]
+            return default if level is None else level
+        return self.far.get(price, default)
+
+    def __getitem__(self, price):
+        level = self.get(price)
+        if level is None:
+            raise KeyError(price)
+        return level
+
+    def __setitem__(self, price, level):
+        if self.anchor is None:
+            self._center(price)
+        i = price - self.anchor
+        if 0 <= i < self.width:
+            self._setSlot(i, level)
+            return
+        best = self._best()
+        if best is None or (price > best if self.high_is_best else price < best):
+            # A new best price outside of the window: bring the window to the touch
+            self._recenter(price)
+            self._setSlot(price - self.anchor, level)
+        else:
+            self.far[price] = level
+
+    def __delitem__(self, price):
+        i = price - self.anchor if self.anchor is not None else -1
+        if not 0 <= i < self.width:
+            del self.far[price]
+            return
+        slots = self.slots
+        if slots[i] is None:
+            raise KeyError(price)
+        slots[i] = None
+        self.present[i] = 0
+        self.sizes[i] = 0
+        self.occupied -= 1
+        if not self.occupied:
+            self.lowSlot = self.highSlot = None
+            if self.far:
+                # The touch moved out of the window
+                self._recenter(self._best())
+            return
+        if i == self.lowSlot:
+            self.lowSlot = self.present.find(1, i)
+        elif i == self.highSlot:
+            self.highSlot = self.present.rfind(1, 0, i)
+
+    def addSize(self, price, size):
+        '''Add size (negative to remove size) to the total size kept for the level at price.'''
+        i = price - self.anchor
+        if 0 <= i < self.width:
+            self.sizes[i] += size
+
+    def pop(self, price, *default):
+        level = self.get(price)
+        if level is None:
+            if default:
+                return default[0]
+            raise KeyError(price)
+        del self[price]
+        return level
+
+    def __contains__(self, price):
+        return self.get(price) is not None
+
+    def __len__(self):
+        return self.occupied + len(self.far)
+
+    def __bool__(self):
+        return bool(self.occupied) or bool(self.far)
+
+    # This method yields the window's prices in increasing order
+    def _window(self):
+        if not self.occupied:
+            return
+        slots = self.slots
+        anchor = self.anchor
+        for i in range(self.lowSlot, self.highSlot + 1):
+            if slots[i] is not None:
+                yield anchor + i
+
+    # This method yields the window's prices in decreasing order
+    def _windowReversed(self):
+        if not self.occupied:
+            return
+        slots = self.slots
+        anchor = self.anchor
+        for i in range(self.highSlot, self.lowSlot - 1, -1):
+            if slots[i] is not None:
+                yield anchor + i
+
+    def __iter__(self):
+        if not self.far:
+            return self._window()
+        if self.anchor is None:
+            return iter(self.far)
+        far = self.far
+        return chain(far.irange(maximum=self.anchor, inclusive=(True, False)), self._window(),
+                     far.irange(minimum=self.anchor + self.width))
+
+    def __reversed__(self):
+        if not self.far:
+            return self._windowReversed()
+        if self.anchor is None:
+            return reversed(self.far)
+        far = self.far
+        return chain(far.irange(minimum=self.anchor + self.width, reverse=True), self._windowReversed(),
+                     far.irange(maximum=self.anchor, inclusive=(True, False), reverse=True))
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[price] for price in self]
+
+    def items(self):
+        return [(price, self[price]) for price in self]
+
+    def peekitem(self, index=-1):
+        '''
+        Return the (price, level) pair at a position in increasing price order, like SortedDict.peekitem.
+
+        Positions among the far levels are found with the SortedDict's positional index. Positions in the window are
+        found by scanning its slots from the nearer end, so a lookup costs O(log n) plus at most `width` slots rather
+        than a walk over every level.
+        '''
+        size = len(self)
+        if not -size <= index < size:
+            raise IndexError('ladder index out of range')
+        if index < 0:
+            index += size
+        far = self.far
+        if self.anchor is None or not self.occupied:
+            return far.peekitem(index)
+        # Far levels below the window come first in increasing order, then the window, then the far levels above it
+        below = far.bisect_left(self.anchor)
+        if index < below:
+            return far.peekitem(index)
+        if index >= below + self.occupied:
+            return far.peekitem(index - self.occupied)
+        index -= below
+        if index < self.occupied // 2:
+            prices = self._window()
+        else:
+            prices = self._windowReversed()
+            index = self.occupied - 1 - index
+        for i, price in enumerate(prices):
+            if i == index:
+                return price, self.slots[price - self.anchor]
+
+    # This method returns (low, high, found): the slots low to high - 1 from the touch hold the best found levels of
+    # the window, which is n unless the window holds fewer
+    def _bestRange(self, n):
+        if not self.occupied or n <= 0:
+            return 0, 0, 0
+        # Start with the n slots from the touch, then widen the range by the number of levels still missing. The new
+        # slots cannot hold more levels than that, so the range never takes in more than n levels
+        present = self.present
+        lowSlot = self.lowSlot
+        highSlot = self.highSlot
+        if self.high_is_best:
+            high = highSlot + 1
+            low = max(lowSlot, high - n)
+            found = present.count(1, low, high)
+            while found < n and low > lowSlot:
+                start = max(lowSlot, low - (n - found))
+                found += present.count(1, start, low)
+                low = start
+        else:
+            low = lowSlot
+            high = min(highSlot + 1, low + n)
+            found = present.count(1, low, high)
+            while found < n and high <= highSlot:
+                end = min(highSlot + 1, high + (n - found))
+                found += present.count(1, high, end)
+                high = end
+        return low, high, found
+
+    # This method yields the far prices, best first
+    def _farPrices(self):
+        return reversed(self.far) if self.high_is_best else iter(self.far)
+
+    def bestPrices(self, n):
+        '''Return the best n prices, best first.'''
+        low, high, found = self._bestRange(n)
+        anchor = self.anchor
+        window = range(anchor + high - 1, anchor + low - 1, -1) if self.high_is_best else range(anchor + low, anchor + high)
+        if high - low == found:
+            # No empty slots in the range, so the prices are consecutive ticks
+            prices = list(window)
+        else:
+            present = self.present
+            prices = [price for price in window if present[price - anchor]]
+        if found < n and self.far:
+            prices.extend(islice(self._farPrices(), n - found))
+        return prices
+
+    def bestItems(self, n):
+        '''Return the (price, level) pairs of the best n levels, best first.'''
+        low, high, found = self._bestRange(n)
+        slots = self.slots
+        anchor = self.anchor
+        window = range(high - 1, low - 1, -1) if self.high_is_best else range(low, high)
+        items = [(anchor + i, slots[i]) for i in window if slots[i] is not None]
+        if found < n and self.far:
+            far = self.far
+            items.extend((price, far[price]) for price in islice(self._farPrices(), n - found))
+        return items
+
+    def depth(self, n):
+        '''Return the total size of the best n levels.'''
+        low, high, found = self._bestRange(n)
+        # Empty slots hold a size of 0, so the depth of the window's levels is the sum of the range
+        total = sum(self.sizes[low:high])
+        if found < n and self.far:
+            far = self.far
+            total += sum(far[price].size for price in islice(self._farPrices(), n - found))
+        return total
@@ -0,0 +1,100 @@
+#
+# depth_index.py
+#
+#
+# Fenwick tree of the size and notional resting at each price of one side of the book
+
+
+class DepthIndex(object):
+    '''
+    Binary indexed (Fenwick) tree over the integer prices (ticks) of one side of the book. Every node holds
+    [size, notional] where notional is price * size, so the depth and cost from the best price down to any price are
+    prefix sums, and the price at which a given size or notional is reached is found by one descent of the tree.
+    Updates, prefix sums and searches visit at most `bits` nodes.
+
+    Positions are ordered best first (descending prices for bids), and only nodes covering prices that hold size
+    are stored, so the tree stays small even though it spans 2**bits prices.
+    '''
+
+    def __init__(self, descending, bits=32):
+        self.descending = descending
+        self.bits = bits
+        self.top = 1 << bits
+        self.nodes = {}
+
+    # This method builds an index from (price, size) pairs
+    @classmethod
+    def fromLevels(cls, descending, levels, bits=32):
+        index = cls(descending, bits)
+        for price, size in levels:
+            index.add(price, size)
+        return index
+
+    # This method returns the 1-based tree position of a price
+    def _position(self, price):
+        if not 0 <= price < self.top:
+            raise ValueError('Price {} is outside of the depth index range (0 - {} ticks)'.format(price, self.top - 1))
+        return self.top - price if self.descending else price + 1
+
+    # This method returns the price at a 1-based tree position
+    def _price(self, position):
+        return self.top - position if self.descending else position - 1
+
+    # This method adds size (negative to remove size) at a price
+    def add(self, price, size):
+        notional = price * size
+        nodes = self.nodes
+        top = self.top
+        i = self._position(price)
+        while i <= top:
+            node = nodes.get(i)
+            if node is None:
+                nodes[i] = [size, notional]
+            else:
+                node[0] += size
+                node[1] += notional
+                if not node[0] and not node[1]:
+                    # Nothing rests under this node anymore
+                    del nodes[i]
+            i += i & -i
+
+    # This method returns (size, notional) resting at the given price and every better price
+    def prefix(self, price):
+        nodes = self.nodes
+        size = notional = 0
+        i = self._position(price)
+        while i:
+            node = nodes.get(i)
+            if node is not None:
+                size += node[0]
+                notional += node[1]
+            i &= i - 1
+        return size, notional
+
+    # This method returns (size, notional) of the whole side
+    def total(self):
+        node = self.nodes.get(self.top)
+        return (node[0], node[1]) if node is not None else (0, 0)
+
+    # This method finds the best price at which the cumulative size (field 0) or notional (field 1) reaches target
+    def search(self, target, field=0):
+        '''
+        Returns (price, size, notional) where size and notional are the sums over the prices better than price,
+        or None if the whole side holds less than target
+        '''
+        if self.total()[field] < target:
+            return None
+        nodes = self.nodes
+        position = 0
+        sums = [0, 0]
+        step = self.top >> 1
+        while step:
+            node = nodes.get(position + step)
+            if node is None:
+                position += step
+            elif sums[field] + node[field] < target:
+                position += step
+                sums[0] += node[0]
+                sums[1] += node[1]
+            step >>= 1
+        return self._price(position + 1), sums[0], sums[1]
@@ -0,0 +1,168 @@
+#
+# feed_log.py
+#
+#
+# Append-only, compressed log of raw websocket frames and rest api snapshots
+
+import gzip
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Every record is a receive timestamp and a payload length followed by the payload
+_HEADER = struct.Struct('<dI')
+
+
+class FeedRecorder(object):
+    """Records raw websocket frames to `path` and level 3 snapshots to `path + '.snapshots'`.
+
+    Every recorder starts a new segment of each file: `path` itself if it
+    does not exist yet, otherwise the first free `path.1`, `path.2`, ...
+    read_log reads the segments in that order, so a recording can be
+    continued across restarts. A segment cut short by a crash is read up to
+    its last complete record and never affects the segments after it.
+
+    `write_frame` runs on the thread receiving the feed, so it only appends
+    the record to a buffer. A writer thread compresses the buffer every
+    `flush_interval` seconds, or sooner once `buffer_bytes` are waiting.
+    Each of these writes is a complete gzip member, so a crash loses at most
+    the records buffered since the last one.
+    """
+
+    def __init__(self, path, flush_interval=0.5, buffer_bytes=1 << 20):
+        self.path = path
+        self.snapshot_path = path + '.snapshots'
+        self.segment_path = _new_segment(path)
+        self.flush_interval = flush_interval
+        self.buffer_bytes = buffer_bytes
+        self._frames = open(self.segment_path, 'ab')
+        self._snapshots = None
+        # Guards the files
+        self._lock = threading.Lock()
+        # Guards the buffered records
+        self._pending = []
+        self._pendingBytes = 0
+        self._ready = threading.Condition(threading.Lock())
+        self._closed = False
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    def write_frame(self, data, timestamp=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if timestamp is None:
+            timestamp = time.time()
+        with self._ready:
+            self._pending.append(_HEADER.pack(timestamp, len(data)))
+            self._pending.append(data)
+            self._pendingBytes += _HEADER.size + len(data)
+            if self._pendingBytes >= self.buffer_bytes:
+                self._ready.notify()
+
+    # This method runs on the writer thread and compresses the buffered frames
+    def _write(self):
+        while True:
+            with self._ready:
+                if not self._closed and self._pendingBytes < self.buffer_bytes:
+                    self._ready.wait(self.flush_interval)
+                closed = self._closed
+            self._drain()
+            if closed:
+                return
+
+    # This method writes out everything buffered so far
+    def _drain(self):
+        with self._lock:
+            with self._ready:
+                pending = self._pending
+                self._pending = []
+                self._pendingBytes = 0
+            if pending and not self._frames.closed:
+                self._frames.write(_compress(b''.join(pending)))
+                self._frames.flush()
+
+    def write_snapshot(self, snapshot, timestamp=None, product_id=None):
+        if product_id is not None:
+            # Tag the snapshot so feeds with several products can be replayed
+            snapshot = dict(snapshot, product_id=product_id)
+        data = json.dumps(snapshot, separators=(',', ':')).encode('utf-8')
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            if self._snapshots is None:
+                self._snapshots = open(_new_segment(self.snapshot_path), 'ab')
+            # Snapshots are rare, so make each one durable straight away
+            self._snapshots.write(_compress(_HEADER.pack(timestamp, len(data)) + data))
+            self._snapshots.flush()
+
+    def flush(self):
+        self._drain()
+        with self._lock:
+            self._frames.flush()
+
+    def close(self):
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+        self._writer.join()
+        with self._lock:
+            self._frames.close()
+            if self._snapshots is not None:
+                self._snapshots.close()
+
+
+# This function compresses one write of a recorder as a complete gzip member. Level 1 compresses several times
+# faster than the default 9 for a slightly bigger log
+def _compress(data):
+    return gzip.compress(data, compresslevel=1)
+
+
+# This function returns the paths of the existing segments of a log, in the order they were recorded
+def log_segments(path):
+    segments = []
+    if os.path.exists(path):
+        segments.append(path)
+    index = 1
+    while os.path.exists('{}.{}'.format(path, index)):
+        segments.append('{}.{}'.format(path, index))
+        index += 1
+    return segments
+
+
+# This function returns the path of the next segment of a log
+def _new_segment(path):
+    segments = len(log_segments(path))
+    return '{}.{}'.format(path, segments) if segments else path
+
+
+def read_log(path):
+    """Yield (timestamp, payload bytes) for every complete record in every segment of a log."""
+    for segment in log_segments(path):
+        for record in _read_segment(segment):
+            yield record
+
+
+def _read_segment(path):
+    with gzip.open(path, 'rb') as f:
+        while True:
+            try:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return
+                timestamp, length = _HEADER.unpack(header)
+                data = f.read(length)
+            except (EOFError, zlib.error, gzip.BadGzipFile):
+                # The recorder was stopped without finishing its last write, i.e. by a crash
+                return
+            if len(data) < length:
+                return
+            yield timestamp, data
+
+
+def read_snapshots(path):
+    """Yield (timestamp, snapshot dict) for every snapshot in a snapshot log."""
+    for timestamp, data in read_log(path):
+        yield timestamp, json.loads(data)
@@ -0,0 +1,71 @@
+#
+# fixed_point.py
+#
+#
+# Scaled integer representation of prices and sizes for the order book
+
+from decimal import Decimal
+
+# float(value) * scale is off by up to about |scaled| / 2**52, which stays below half a tick only while the scaled
+# magnitude is under 2**51. Values from 2**50 up are parsed with Decimal, which leaves a margin
+_FLOAT_EXACT_LIMIT = 2 ** 50
+
+
+class FixedPoint(object):
+    '''
+    Converts between exchange decimal strings and scaled integers.
+
+    The scale is taken from a product increment (i.e. quote_increment "0.01" gives 2 decimal places),
+    so 43123.45 is held as the int 4312345. Values with non-zero digits finer than the increment raise ValueError
+    instead of being rounded, since totals and comparisons of rounded sizes would silently drift.
+    '''
+
+    def __init__(self, increment, cacheSize=0):
+        self.increment = increment
+        exponent = Decimal(increment).normalize().as_tuple().exponent
+        # Number of decimal places kept by this scale
+        self.places = max(0, -exponent)
+        self.scale = 10 ** self.places
+        # Length of the dot and the decimal places kept
+        self._digits = self.places + 1
+        # Optional cache of string -> int conversions. Prices repeat heavily near the spread, so a dict lookup
+        # is much cheaper than parsing the same string again
+        self.cacheSize = cacheSize
+        self._cache = {}
+        if not cacheSize:
+            # Skip the cache lookups entirely
+            self.toInt = self._parse
+
+    # This method converts a decimal string (or Decimal/int/float) to a scaled integer
+    def toInt(self, value):
+        scaled = self._cache.get(value)
+        if scaled is None:
+            scaled = self._parse(value)
+            if len(self._cache) >= self.cacheSize:
+                # Simply start over once the cache is full; the hot prices are re-added straight away
+                self._cache.clear()
+            self._cache[value] = scaled
+        return scaled
+
+    def _parse(self, value):
+        if value.__class__ is not str:
+            # Decimal, int or float, checked through their text like the exchange's strings (str(0.1) is '0.1')
+            value = str(value)
+        dot = value.find('.')
+        # Only zeros may follow the digits kept by the scale
+        if (len(value) - dot <= self._digits or not value[dot + self._digits:].strip('0')) if dot >= 0 \
+                else value.isdigit():
+            if 'e' not in value and 'E' not in value:
+                scaled = round(float(value) * self.scale)
+                if -_FLOAT_EXACT_LIMIT < scaled < _FLOAT_EXACT_LIMIT:
+                    return scaled
+        # Negative whole numbers, exponent notation, digits finer than the increment or too large to parse with floats
+        exact = Decimal(value).scaleb(self.places)
+        scaled = int(exact)
+        if scaled != exact:
+            raise ValueError('{} is finer than the increment {}'.format(value, self.increment))
+        return scaled
+
+    # This method converts a scaled integer back to a Decimal
+    def toDecimal(self, scaled):
+        return Decimal(scaled).scaleb(-self.places)
@@ -0,0 +1,46 @@
+#
+# json_decoders.py
+#
+#
+# Pluggable JSON decoders for websocket frames. Faster backends are used when they are installed
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def get_decoder(decoder='auto'):
+    """Return a function that decodes a JSON str or bytes frame.
+
+    Args:
+        decoder (Optional[str or callable]): 'json', 'orjson', 'ujson', or
+            'auto' for the fastest installed backend. A callable is returned
+            unchanged.
+
+    """
+    if callable(decoder):
+        return decoder
+    if decoder == 'auto':
+        for backend in (orjson, ujson):
+            if backend is not None:
+                return backend.loads
+        return json.loads
+    if decoder == 'json':
+        return json.loads
+    if decoder == 'orjson':
+        if orjson is None:
+            raise ImportError('orjson is not installed')
+        return orjson.loads
+    if decoder == 'ujson':
+        if ujson is None:
+            raise ImportError('ujson is not installed')
+        return ujson.loads
+    raise ValueError('Unknown decoder {}, must be one of: auto, json, orjson, ujson'.format(decoder))
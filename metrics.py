@@ -0,0 +1,234 @@
+#
+# metrics.py
+#
+#
+# Low overhead counters and latency histograms for the websocket clients and order books
+
+import calendar
+import time
+from collections import defaultdict
+
+# Histogram buckets are exact below 2 * _SUB_BUCKETS and then _SUB_BUCKETS per power of two,
+# so every recorded value is off by at most 1 / _SUB_BUCKETS (about 3%)
+_SUB_BITS = 5
+_SUB_BUCKETS = 1 << _SUB_BITS
+# Buckets allocated up front, enough for values below 2**40 (18 minutes in nanoseconds)
+_INITIAL_BUCKETS = (40 - _SUB_BITS) << _SUB_BITS
+
+
+class Histogram(object):
+    """HDR style histogram of non-negative integers.
+
+    Values are counted in log-linear buckets: each power of two is split
+    into 32 equal buckets. Recording is a few integer operations and the
+    memory used only grows with the log of the largest value, so it can be
+    left on in the hot path. Percentiles are the lower bound of their
+    bucket.
+    """
+
+    def __init__(self):
+        self.counts = [0] * _INITIAL_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(value):
+        shift = value.bit_length() - _SUB_BITS - 1
+        if shift <= 0:
+            return value
+        return (shift << _SUB_BITS) + (value >> shift)
+
+    @staticmethod
+    def _lowest(index):
+        if index < 2 * _SUB_BUCKETS:
+            return index
+        shift = (index >> _SUB_BITS) - 1
+        return (index - (shift << _SUB_BITS)) << shift
+
+    def record(self, value):
+        """Count a value. Negative values are counted as 0."""
+        if value < 0:
+            value = 0
+        # Same as _index, inlined on the hot path
+        shift = value.bit_length() - _SUB_BITS - 1
+        index = (shift << _SUB_BITS) + (value >> shift) if shift > 0 else value
+        try:
+            self.counts[index] += 1
+        except IndexError:
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+            self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """Return the value below which p percent of the recorded values fall (0 if nothing was recorded)."""
+        if not self.count:
+            return 0
+        target = max(1, -(-self.count * p // 100))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self._lowest(index), self.max)
+        return self.max
+
+    def snapshot(self, scale=1):
+        """Return count, mean, percentiles and max, with values divided by scale.
+
+        Returns:
+            dict: Example::
+                {
+                    "count": 10324,
+                    "mean": 3.1,
+                    "p50": 2.8,
+                    "p90": 4.4,
+                    "p99": 9.7,
+                    "p999": 31.0,
+                    "max": 220.5
+                }
+
+        """
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': self.total / self.count / scale,
+            'p50': self.percentile(50) / scale,
+            'p90': self.percentile(90) / scale,
+            'p99': self.percentile(99) / scale,
+            'p999': self.percentile(99.9) / scale,
+            'max': self.max / scale,
+        }
+
+
+class FeedMetrics(object):
+    """Counters and histograms of a feed and the books it updates.
+
+    Times are recorded in nanoseconds and reported in microseconds.
+    Decode and apply times and message counts are kept per message type.
+    Publish times are kept per batch, since on_batch_end runs once per
+    batch. Lag is the time from a message's exchange `time` field to the
+    end of its on_message, so it includes clock skew between the exchange
+    and this host. Frames dropped by `skip_types` are counted as
+    'skipped'.
+
+    A WebsocketClient created with metrics=True records into one of these
+    (see WebsocketClient.stats).
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.messages = defaultdict(int)
+        self.decode = defaultdict(Histogram)
+        self.apply = defaultdict(Histogram)
+        self.publish = Histogram()
+        self.lag = Histogram()
+        # Messages whose exchange time is ahead of this host's clock. Their lag is recorded as 0
+        self.negative_lag = 0
+        self.gaps = 0
+        self.missed_messages = 0
+        self.resyncs = 0
+        self.resync = Histogram()
+        self.resync_buffer = Histogram()
+        self.queue_depth = Histogram()
+        self.disconnects = 0
+        self.reconnects = 0
+        self.reconnect_attempts = Histogram()
+        self.recover = Histogram()
+        # Date and second of the last exchange time seen and its epoch seconds. Consecutive messages share them,
+        # so only the fraction of most 'time' fields is parsed
+        self._lastSecond = None
+        self._lastEpoch = 0
+
+    def record_message(self, msg_type, decode_ns, apply_ns=None, exchange_time=None):
+        self.messages[msg_type] += 1
+        self.decode[msg_type].record(decode_ns)
+        if apply_ns is not None:
+            self.apply[msg_type].record(apply_ns)
+        if exchange_time:
+            # i.e. 2020-01-01T12:00:00.123456Z
+            second = exchange_time[:19]
+            try:
+                if second != self._lastSecond:
+                    self._lastEpoch = calendar.timegm(time.strptime(second, '%Y-%m-%dT%H:%M:%S'))
+                    self._lastSecond = second
+                sent = self._lastEpoch + float(exchange_time[19:-1] or 0)
+            except ValueError:
+                return
+            lag = int((time.time() - sent) * 1e9)
+            if lag < 0:
+                # Clock skew: this host is behind the exchange
+                self.negative_lag += 1
+                lag = 0
+            self.lag.record(lag)
+
+    def record_publish(self, ns):
+        self.publish.record(ns)
+
+    def record_queue_depth(self, depth):
+        self.queue_depth.record(depth)
+
+    def record_gap(self, missed):
+        self.gaps += 1
+        self.missed_messages += missed
+
+    def record_resync(self, ns, buffered):
+        """Record a finished resync: how long the book was not live and how many messages were buffered meanwhile."""
+        self.resyncs += 1
+        self.resync.record(ns)
+        self.resync_buffer.record(buffered)
+
+    def record_disconnect(self):
+        self.disconnects += 1
+
+    def record_reconnect(self, ns, attempts):
+        """Record a reconnect: the time from losing the connection to being subscribed again and the attempts it took."""
+        self.reconnects += 1
+        self.recover.record(ns)
+        self.reconnect_attempts.record(attempts)
+
+    def snapshot(self):
+        """Return every counter and histogram as plain dicts (see Histogram.snapshot)."""
+        us = 1000
+        return {
+            'uptime': time.time() - self.started,
+            'messages': dict(self.messages),
+            'decode': dict((t, h.snapshot(us)) for t, h in list(self.decode.items())),
+            'apply': dict((t, h.snapshot(us)) for t, h in list(self.apply.items())),
+            'publish': self.publish.snapshot(us),
+            'lag': self.lag.snapshot(us),
+            'negative_lag': self.negative_lag,
+            'gaps': self.gaps,
+            'missed_messages': self.missed_messages,
+            'resyncs': self.resyncs,
+            'resync': self.resync.snapshot(us),
+            'resync_buffer': self.resync_buffer.snapshot(),
+            'queue_depth': self.queue_depth.snapshot(),
+            'disconnects': self.disconnects,
+            'reconnects': self.reconnects,
+            'reconnect_attempts': self.reconnect_attempts.snapshot(),
+            'recover': self.recover.snapshot(us),
+        }
+
+
+def format_stats(stats):
+    """Return a one line summary of a stats snapshot for periodic dumps."""
+    messages = stats.get('messages', {})
+    apply = stats.get('apply', {})
+    parts = ['{} msgs'.format(sum(messages.values()))]
+    for msg_type in sorted(messages):
+        latency = apply.get(msg_type)
+        if latency and latency['count']:
+            parts.append('{} {} p50 {:.1f}us p99 {:.1f}us'.format(msg_type, messages[msg_type], latency['p50'],
+                                                                 latency['p99']))
+        else:
+            parts.append('{} {}'.format(msg_type, messages[msg_type]))
+    lag = stats.get('lag', {})
+    if lag.get('count'):
+        parts.append('lag p50 {:.1f}ms p99 {:.1f}ms'.format(lag['p50'] / 1000, lag['p99'] / 1000))
+    parts.append('gaps {} resyncs {} reconnects {}'.format(stats.get('gaps', 0), stats.get('resyncs', 0),
+                                                          stats.get('reconnects', 0)))
+    return ' | '.join(parts)
@@ -0,0 +1,142 @@
+#
+# mongo_sink.py
+#
+#
+# Buffers websocket messages and writes them to MongoDB in batches on a background thread
+
+import threading
+import time
+from collections import deque
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+
+class MongoSink(object):
+    """Batched, asynchronous writer for a MongoDB collection.
+
+    `put` only appends to an in-memory buffer. A background thread writes the
+    buffer with `insert_many` once `batch_size` documents are waiting or
+    `flush_interval` seconds have passed since the last write.
+
+    Args:
+        collection: pymongo collection (anything with `insert_many` works)
+        batch_size (Optional[int]): Documents per insert_many call.
+        flush_interval (Optional[float]): Seconds before a partial batch is written.
+        max_buffer (Optional[int]): Most documents held in memory.
+        overflow (Optional[str]): What `put` does when the buffer is full:
+            'drop_oldest' (default), 'drop_newest' or 'block'.
+
+    """
+
+    def __init__(self, collection, batch_size=500, flush_interval=1.0, max_buffer=100000, overflow='drop_oldest'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Overflow policy is {}, must be one of: {}'.format(overflow, OVERFLOW_POLICIES))
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.overflow = overflow
+
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._has_work = threading.Condition(self._lock)
+        self._has_room = threading.Condition(self._lock)
+        self._closed = False
+        self._flush_requested = False
+
+        self.inserted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_size = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, doc):
+        """Buffer a document. Returns False if it was dropped."""
+        with self._lock:
+            if self._closed:
+                raise ValueError('MongoSink is closed')
+            if len(self._buffer) >= self.max_buffer:
+                if self.overflow == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                elif self.overflow == 'drop_oldest':
+                    self._buffer.popleft()
+                    self.dropped += 1
+                else:
+                    self._has_room.wait_for(lambda: len(self._buffer) < self.max_buffer or self._closed)
+            self._buffer.append(doc)
+            if len(self._buffer) >= self.batch_size:
+                self._has_work.notify()
+            return True
+
+    def flush(self):
+        """Ask the background thread to write everything buffered now."""
+        with self._lock:
+            self._flush_requested = True
+            self._has_work.notify()
+
+    def close(self):
+        """Write everything still buffered and stop the background thread."""
+        with self._lock:
+            self._closed = True
+            self._has_work.notify()
+            self._has_room.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'buffered': len(self._buffer),
+                'inserted': self.inserted,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'flushes': self.flushes,
+                'last_flush_size': self.last_flush_size,
+                'last_flush_seconds': self.last_flush_seconds,
+                'max_flush_seconds': self.max_flush_seconds,
+            }
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            with self._lock:
+                def ready():
+                    return (len(self._buffer) >= self.batch_size or self._closed or self._flush_requested or
+                            (self._buffer and time.monotonic() - last_flush >= self.flush_interval))
+                self._has_work.wait_for(ready, timeout=self.flush_interval)
+                if not self._buffer:
+                    if self._closed:
+                        return
+                    self._flush_requested = False
+                    last_flush = time.monotonic()
+                    continue
+                if not ready():
+                    continue
+                n = min(self.batch_size, len(self._buffer))
+                batch = [self._buffer.popleft() for _ in range(n)]
+                if not self._buffer:
+                    self._flush_requested = False
+                self._has_room.notify_all()
+
+            start = time.monotonic()
+            try:
+                self.collection.insert_many(batch, ordered=False)
+            except Exception as e:
+                print('MongoSink: insert_many of {} documents failed - {}'.format(len(batch), e))
+                with self._lock:
+                    self.failed += len(batch)
+            else:
+                with self._lock:
+                    self.inserted += len(batch)
+            elapsed = time.monotonic() - start
+            last_flush = time.monotonic()
+            with self._lock:
+                self.flushes += 1
+                self.last_flush_size = len(batch)
+                self.last_flush_seconds = elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
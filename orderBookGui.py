@@ -19,35 +19,45 @@ class OrderBookProducer(OrderBookFull):
         ''' Logs real-time changes to the bid-ask price and sends to gui (consumer) thread '''
 
         def __init__(self, gui_q,levels,product_id=None):
-            super(OrderBookProducer, self).__init__(product_id=product_id)
+            # Receive frames on their own thread and apply them in batches, so a slow publish never delays recv()
+            super(OrderBookProducer, self).__init__(product_id=product_id, pipeline=True)
 
             # Queue shared by order book thread and gui (consumer) thread that stores order book snapshots
             self.gui_q = gui_q
 
             # Amount of prices to display in the order book gui
             self.levels = levels
+
+            # Have the book tell us when the top self.levels bid or ask levels change
+            self.trackTopOfBook(levels)
             
         
-        def on_message(self, message):
-            super(OrderBookProducer, self).on_message(message)
-
-            # Get the current top self.levels asks and bids from the full orderbook 
-            # i.e. if self.levels = 5, we get to top 5 bid and ask prices
-            topAsks = self.getTopAsks(self.levels)
-            topBids = self.getTopBids(self.levels)
+        def on_top_of_book_changed(self, top):
+            # Called at most once per batch of messages, and only when one of the displayed levels changed
 
-            # Construct message to send to gui (receiver) thread
-            msgForQ = {"topAsks": topAsks,"topBids":topBids}
+            # Construct message to send to gui (receiver) thread: the top self.levels ask and bid levels of the
+            # full orderbook as (price, size, number of orders), best first.
+            # i.e. if self.levels = 5, we get to top 5 bid and ask levels
+            msgForQ = {"asks": top["asks"],"bids":top["bids"]}
 
             try:
-                # Put orderbook snap shot in queue for receiver thread
-                self.gui_q.put(msgForQ,block=False)
-            except queue.Full:
-                # Gui thread has not removed order book snapshot message yet from queue–do not place in another .
+                # Gui thread has not removed the previous order book snapshot yet–replace it with this newer one,
+                # since we only publish on changes and the last change must not be lost
+                self.gui_q.get_nowait()
+            except queue.Empty:
                 pass
+            # Put orderbook snap shot in queue for receiver thread
+            self.gui_q.put(msgForQ,block=False)
 
 class OrderBookConsumer(tkinter.Frame):
-        def __init__(self,parent,in_q,levels):
+        # Layout of the ladder canvas
+        ROW_HEIGHT = 18
+        WIDTH = 330
+        PRICE_X = 70
+        SIZE_X = 175
+        DEPTH_X = 280
+
+        def __init__(self,parent,in_q,levels,fps=30):
             tkinter.Frame.__init__(self, parent)
             
             # queue shared by OrderBookConsumer (gui thread) and OrderBookProducer (websocket thread)
@@ -55,79 +65,111 @@ class OrderBookConsumer(tkinter.Frame):
             
             # Amount of prices to display in the order book gui
             self.levels = levels
+
+            # Most redraws per second. Between frames the gui thread sleeps in the tk event loop
+            self.frameInterval = max(1, int(1000 / fps))
             
             # gui window object
             self.parent = parent
             
             # gui window title
             self.parent.title("Order Book")
-           
-            # This list will hold the stringvars attached to each bid/asl label 
-            self.bidTexts = []
-            self.askTexts = []
-
-            # This list will hold all the bid/asl labels. Each label is an item in the list displayed in the gui window
-            self.bidLabels = []
-            self.askLabels = []
 
-            # Initialize the gui window ask list 
-            self.createList(self.askLabels,self.askTexts,"red",self.levels)
-            
-            # Initialize the spread label 
-            self.spreadText = tkinter.StringVar()
-            self.spreadText.set("0.00")
-            self.spreadLabel = tkinter.Label(self.parent,textvariable = self.spreadText,fg = "white",bg="black")
-            self.spreadLabel.pack()
-            
-            # Initialize the gui window bid list 
-            self.createList(self.bidLabels,self.bidTexts,"green",self.levels)
-
-            # Start continuous loop to refresh orderbook gui every millisecond
-            self.parent.after(1,self.refreshBook)
-
-        # Initialize our bid and ask lists
-        def createList(self,labels,texts,textColor,n):
-            for i in range(n):
-                texts.append(tkinter.StringVar())
-                texts[i].set("0.00")
-                labels.append(tkinter.Label(self.parent,textvariable = texts[i],fg = textColor,bg="black"))
-                labels[i].pack()
+            # The whole ladder is drawn on one canvas: asks (best at the bottom), the spread, then bids (best at the top)
+            rows = 2 * levels + 1
+            self.canvas = tkinter.Canvas(self.parent, width=self.WIDTH, height=rows * self.ROW_HEIGHT,
+                                         bg="black", highlightthickness=0)
+            self.canvas.pack()
+
+            # Canvas items of every row, and the values they currently show so unchanged rows are not redrawn
+            self.rows = []
+            self.shown = []
+            for row in range(rows):
+                self.rows.append(self.createRow(row))
+                self.shown.append(None)
+
+            # Start the render loop
+            self.parent.after(self.frameInterval,self.refreshBook)
+
+        # This method creates the canvas items of one row: a depth bar behind the price, size and depth texts
+        def createRow(self,row):
+            top = row * self.ROW_HEIGHT
+            middle = top + self.ROW_HEIGHT // 2
+            if row < self.levels:
+                textColor, barColor = "red", "#3a0000"
+            elif row == self.levels:
+                textColor, barColor = "white", "black"
+            else:
+                textColor, barColor = "green", "#003a00"
+            bar = self.canvas.create_rectangle(self.WIDTH, top + 1, self.WIDTH, top + self.ROW_HEIGHT - 1,
+                                               fill=barColor, width=0)
+            price = self.canvas.create_text(self.PRICE_X, middle, text="", fill=textColor, anchor="e")
+            size = self.canvas.create_text(self.SIZE_X, middle, text="", fill=textColor, anchor="e")
+            depth = self.canvas.create_text(self.DEPTH_X, middle, text="", fill=textColor, anchor="e")
+            return (bar, price, size, depth)
         
-        # Call this every millisecond to update the order book view 
+        # Called every frame to update the order book view 
         def refreshBook(self):
             try:
-                # Get (consume) data sent from orderbook thread
+                # Get (consume) the latest data sent from orderbook thread
                 data = self.in_q.get(block=False)
-                # Update spread label text
-                self.spreadText.set(self.formatPrice(data["topAsks"][0]-data["topBids"][0]))
-                # Update ask and bid list text
-                self.updateList(data["topAsks"],data["topBids"])
             except queue.Empty:
-                # No messages sent from orderbook thread
+                # Nothing changed since the last frame
                 pass
+            else:
+                self.render(data["asks"],data["bids"])
             finally:
-                # Update order book view again in 1 millisecond
-                self.parent.after(1,self.refreshBook)
-        
-        # This method updates ask and bid lists
-        def updateList(self,asks,bids):
-            for i,bid in enumerate(bids):
-                self.bidTexts[i].set(self.formatPrice(bid))
-
-            for i,ask in enumerate(asks):
-                # List asks in reverse order
-                self.askTexts[len(self.askTexts)-1-i].set(self.formatPrice(ask))
-         
+                # Update order book view again next frame
+                self.parent.after(self.frameInterval,self.refreshBook)
+
+        # This method redraws the rows whose values changed
+        def render(self,asks,bids):
+            askRows = self.ladderRows(asks)
+            bidRows = self.ladderRows(bids)
+            maxDepth = max([row[2] for row in askRows + bidRows if row[2]] or [0])
+
+            # List asks in reverse order, so the best ask is next to the spread
+            rows = list(reversed(askRows))
+            rows.append((self.formatPrice(asks[0][0] - bids[0][0]) if asks and bids else "", None, None))
+            rows.extend(bidRows)
+
+            for i,row in enumerate(rows):
+                price, size, depth = row
+                width = int(self.WIDTH * depth / maxDepth) if depth and maxDepth else 0
+                shown = (price, size, depth, width)
+                if shown == self.shown[i]:
+                    continue
+                self.shown[i] = shown
+                bar, priceItem, sizeItem, depthItem = self.rows[i]
+                self.canvas.itemconfigure(priceItem, text=price)
+                self.canvas.itemconfigure(sizeItem, text=self.formatSize(size))
+                self.canvas.itemconfigure(depthItem, text=self.formatSize(depth))
+                top = i * self.ROW_HEIGHT
+                self.canvas.coords(bar, self.WIDTH - width, top + 1, self.WIDTH, top + self.ROW_HEIGHT - 1)
+
+        # This method returns (price text, size, cumulative depth) for each displayed level of a side
+        def ladderRows(self,levels):
+            rows = []
+            depth = 0
+            for price, size, count in levels[:self.levels]:
+                depth += size
+                rows.append((self.formatPrice(price), size, depth))
+            while len(rows) < self.levels:
+                rows.append(("", None, None))
+            return rows
         
         def formatPrice(self,price):
             return '{0:.2f}'.format(price)
 
+        def formatSize(self,size):
+            return '' if size is None else '{0:.4f}'.format(size)
+
 
 
 
 class OrderBookGui:
 
-    def __init__(self, levels):
+    def __init__(self, levels, fps=30):
         # Create the gui window
         self.root = tkinter.Tk()
         # Set background to black
@@ -140,7 +182,7 @@ class OrderBookGui:
         self.levels = levels
         
         # Create OrderbookConsumer 
-        self.receiver = OrderBookConsumer(self.root,self.q,self.levels)
+        self.receiver = OrderBookConsumer(self.root,self.q,self.levels,fps)
         # Create OrderbookProducer
         self.producer = OrderBookProducer(self.q,self.levels)
        
@@ -0,0 +1,169 @@
+#
+# pagination.py
+#
+#
+# Iterates paginated rest api endpoints, fetching the next page in the background
+
+import queue
+import threading
+
+# Most results the exchange returns per page
+PAGE_SIZE = 100
+
+_END = object()
+
+
+class Paginator(object):
+    """Iterator over the results of a paginated endpoint.
+
+    Pages are requested with the `cb-after` cursor of the previous page. A
+    background thread keeps fetching while the current page is consumed and
+    queues up to `prefetch` pages, so the next page is usually there as soon
+    as it is needed. Requests go through the client's rate limiter.
+
+    `state()` returns the position of the paginator. Pass it back as
+    `after` and `skip` to resume exactly where it stopped, i.e. in a new
+    process. Pages of past data never change, so nothing is repeated or
+    missed. The first page of the newest results has no cursor and can
+    change as new results arrive, so a position on it is given as the
+    `cursor_field` of the last result returned.
+
+    Args:
+        client (PublicClient): Client making the requests (see PublicClient._get_page).
+        endpoint (str): Endpoint (to be added to the client's URL).
+        params (Optional[dict]): HTTP request parameters.
+        limit (Optional[int]): Most results to return. Pages are requested no bigger than needed.
+        after (Optional[str]): Cursor of the first page to request.
+        skip (Optional[int]): Results of the first page already consumed.
+        prefetch (Optional[int]): Pages queued ahead of the one being consumed.
+        cursor_field (Optional[str]): Field of a result that is its cursor, i.e. 'trade_id'.
+
+    """
+
+    def __init__(self, client, endpoint, params=None, limit=None, after=None, skip=0, prefetch=1, cursor_field=None):
+        self.client = client
+        self.url = client.url + endpoint
+        self.params = dict(params or {})
+        self.limit = limit
+        self.prefetch = prefetch
+        self.cursor_field = cursor_field
+        self.pages = 0
+        self.returned = 0
+
+        # The cursor of the page being consumed and how many of its results were returned
+        self._pageCursor = after if after is not None else self.params.pop('after', None)
+        self._index = skip
+        self._page = None
+        self._nextCursor = None
+        self._pages = queue.Queue(maxsize=max(1, prefetch))
+        self._closed = threading.Event()
+        self._thread = None
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            if self._done or (self.limit is not None and self.returned >= self.limit):
+                self.close()
+                raise StopIteration
+            page = self._page
+            if page is not None and self._index < len(page):
+                result = page[self._index]
+                self._index += 1
+                self.returned += 1
+                return result
+            if page is not None:
+                # Move on to the next page
+                self._pageCursor = self._nextCursor
+                self._index = 0
+            self._nextPage()
+
+    def _nextPage(self):
+        if self._thread is None:
+            # Results still to be requested, counting the ones of the first page that are skipped
+            remaining = None if self.limit is None else self.limit - self.returned + self._index
+            # The thread gets no reference to the paginator, so an abandoned paginator is collected and stops it
+            self._thread = threading.Thread(target=_fetch, daemon=True,
+                                            args=(self.client, self.url, dict(self.params), self._pageCursor, remaining,
+                                                  self._pages, self._closed))
+            self._thread.start()
+        item = self._pages.get()
+        if item is _END:
+            self._done = True
+            self._page = None
+            return
+        if isinstance(item, Exception):
+            self._done = True
+            raise item
+        self._page, self._nextCursor = item
+        self.pages += 1
+
+    def state(self):
+        """Return the position to resume from.
+
+        Returns:
+            dict: Example::
+                {
+                    "after": "74",
+                    "skip": 12
+                }
+
+        Raises:
+            ValueError: Results of the first page were returned and the paginator has no cursor_field.
+
+        """
+        page = self._page
+        if page is not None and self._index >= len(page) and self._nextCursor:
+            return {'after': self._nextCursor, 'skip': 0}
+        if self._pageCursor is None and page is not None and self._index:
+            # Skipping into the newest page would repeat or miss whatever arrived in the meantime
+            if self.cursor_field is None:
+                raise ValueError('A position on the first page can only be resumed with a cursor_field')
+            return {'after': str(page[self._index - 1][self.cursor_field]), 'skip': 0}
+        return {'after': self._pageCursor, 'skip': self._index}
+
+    def close(self):
+        """Stop fetching pages ahead."""
+        self._closed.set()
+
+    def __del__(self):
+        self._closed.set()
+
+
+# This function runs on the background thread of a Paginator and queues (results, next cursor) for every page
+def _fetch(client, url, params, after, remaining, pages, closed):
+    try:
+        while not closed.is_set():
+            if after is not None:
+                params['after'] = after
+            if remaining is not None:
+                params['limit'] = min(PAGE_SIZE, remaining)
+            results, after = client._get_page(url, params)
+            if not isinstance(results, list):
+                raise ValueError('Unexpected response {}'.format(results))
+            if not _put(pages, closed, (results, after)):
+                return
+            if remaining is not None:
+                remaining -= len(results)
+            # If this request included `before` don't get any more pages - the
+            # cbpro API doesn't support multiple pages in that case.
+            if not after or not results or params.get('before') is not None or \
+                    (remaining is not None and remaining <= 0):
+                break
+    except Exception as e:
+        _put(pages, closed, e)
+        return
+    _put(pages, closed, _END)
+
+
+# This function queues a page, waiting while the consumer is behind. Returns False if the paginator was closed
+def _put(pages, closed, item):
+    while not closed.is_set():
+        try:
+            pages.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
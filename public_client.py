@@ -3,8 +3,14 @@
 #
 # For public requests to the Coinbase exchange
 
+import time
+
 import requests
 
+from pagination import Paginator
+from rate_limit import TokenBucket, PUBLIC_RATE, PUBLIC_BURST
+from response_cache import ResponseCache
+
 
 class PublicClient(object):
     """cbpro public client API.
@@ -14,19 +20,37 @@ class PublicClient(object):
 
     Attributes:
         url (Optional[str]): API URL. Defaults to cbpro API.
+        rate_limiter (TokenBucket): Paces every request. None if requests are not limited.
+        cache (ResponseCache): Cache of the reference endpoints. None if they are not cached.
 
     """
 
-    def __init__(self, api_url='https://api.pro.coinbase.com', timeout=30):
+    def __init__(self, api_url='https://api.pro.coinbase.com', timeout=30, rate_limit=PUBLIC_RATE,
+                 burst=PUBLIC_BURST, cache=None):
         """Create cbpro API public client.
 
         Args:
-            api_url (Optional[str]): API URL. Defaults to cbpro API.
+            api_url (Optional[str]): API URL. Defaults to cbpro API. Point it
+                at a local server to test against a stand-in.
+            timeout (Optional[float]): Seconds to wait for a response.
+            rate_limit (Optional[float]): Most requests per second on
+                average. Defaults to the public API limit. None disables
+                rate limiting.
+            burst (Optional[int]): Most requests sent at once.
+            cache (Optional[bool or ResponseCache]): Cache the responses of
+                get_products, get_currencies, get_product_24hr_stats and
+                get_time. Pass a ResponseCache to choose the TTLs and size,
+                or to share it between clients.
 
         """
         self.url = api_url.rstrip('/')
+        self.timeout = timeout
         self.auth = None
         self.session = requests.Session()
+        self.rate_limiter = TokenBucket(rate_limit, burst) if rate_limit else None
+        if cache is True:
+            cache = ResponseCache()
+        self.cache = cache or None
 
     def get_products(self):
         """Get a list of available currency pairs for trading.
@@ -46,7 +70,7 @@ class PublicClient(object):
                 ]
 
         """
-        return self._send_message('get', '/products')
+        return self._cached('products', '/products')
 
     def get_product_order_book(self, product_id, level=1):
         """Get a list of open orders for a product.
@@ -113,19 +137,22 @@ class PublicClient(object):
         return self._send_message('get',
                                   '/products/{}/ticker'.format(product_id))
 
-    def get_product_trades(self, product_id, before='', after='', limit=None, result=None):
+    def get_product_trades(self, product_id, before='', after='', limit=None, result=None, skip=0):
         """List the latest trades for a product.
 
-        This method returns a generator which may make multiple HTTP requests
-        while iterating through it.
+        This method returns a Paginator which may make multiple HTTP requests
+        while iterating through it. The next page is fetched in the background
+        while the current one is consumed. Resume an interrupted iteration by
+        passing its `state()` as `after` and `skip`.
 
         Args:
              product_id (str): Product
-             before (Optional[str]): start time in ISO 8601
-             after (Optional[str]): end time in ISO 8601
+             before (Optional[str]): Only trades newer than this trade_id
+             after (Optional[str]): Only trades older than this trade_id
              limit (Optional[int]): the desired number of trades (can be more than 100,
                           automatically paginated)
              results (Optional[list]): list of results that is used for the pagination
+             skip (Optional[int]): Trades of the first page already consumed
         Returns:
              list: Latest trades. Example::
                  [{
@@ -142,8 +169,13 @@ class PublicClient(object):
                      "side": "sell"
          }]
         """
+        params = {}
+        if before:
+            params['before'] = before
         return self._send_paginated_message('/products/{}/trades'
-                                            .format(product_id))
+                                            .format(product_id), params=params,
+                                            limit=limit, after=after or None,
+                                            skip=skip, cursor_field='trade_id')
 
     def get_product_historic_rates(self, product_id, start=None, end=None,
                                    granularity=None):
@@ -215,8 +247,7 @@ class PublicClient(object):
                     }
 
         """
-        return self._send_message('get',
-                                  '/products/{}/stats'.format(product_id))
+        return self._cached('stats', '/products/{}/stats'.format(product_id))
 
     def get_currencies(self):
         """List known currencies.
@@ -234,7 +265,7 @@ class PublicClient(object):
                 }]
 
         """
-        return self._send_message('get', '/currencies')
+        return self._cached('currencies', '/currencies')
 
     def get_time(self):
         """Get the API server time.
@@ -248,7 +279,22 @@ class PublicClient(object):
                     }
 
         """
-        return self._send_message('get', '/time')
+        return self._cached('time', '/time')
+
+    def _cached(self, name, endpoint):
+        """Send a GET request, answered from the cache when there is one.
+
+        Args:
+            name (str): Endpoint name, selects the cache TTL
+            endpoint (str): Endpoint (to be added to base URL)
+
+        Returns:
+            dict/list: JSON response
+
+        """
+        if self.cache is None:
+            return self._send_message('get', endpoint)
+        return self.cache.get(name, endpoint, lambda: self._send_message('get', endpoint))
 
     def _send_message(self, method, endpoint, params=None, data=None):
         """Send API request.
@@ -264,15 +310,36 @@ class PublicClient(object):
 
         """
         url = self.url + endpoint
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
         r = self.session.request(method, url, params=params, data=data,
-                                 auth=self.auth, timeout=30)
+                                 auth=self.auth, timeout=self.timeout)
         return r.json()
 
-    def _send_paginated_message(self, endpoint, params=None):
+    def _get_page(self, url, params):
+        """Request one page of a paginated endpoint.
+
+        Requests rejected for exceeding the rate limit are sent again.
+
+        Returns:
+            tuple: (JSON response, `cb-after` cursor of the next page or None)
+
+        """
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            r = self.session.get(url, params=params, auth=self.auth, timeout=self.timeout)
+            if r.status_code != 429:
+                return r.json(), r.headers.get('cb-after')
+            if self.rate_limiter is None:
+                time.sleep(1)
+
+    def _send_paginated_message(self, endpoint, params=None, limit=None, after=None, skip=0, prefetch=1,
+                                cursor_field=None):
         """ Send API message that results in a paginated response.
 
-        The paginated responses are abstracted away by making API requests on
-        demand as the response is iterated over.
+        The paginated responses are abstracted away by making API requests as
+        the response is iterated over, one page ahead (see pagination.py).
 
         Paginated API messages support 3 additional parameters: `before`,
         `after`, and `limit`. `before` and `after` are mutually exclusive. To
@@ -286,25 +353,16 @@ class PublicClient(object):
         Args:
             endpoint (str): Endpoint (to be added to base URL)
             params (Optional[dict]): HTTP request parameters
+            limit (Optional[int]): Most results in total. Pages are requested
+                with a `limit` no bigger than needed.
+            after (Optional[str]): Cursor of the first page
+            skip (Optional[int]): Results of the first page to leave out
+            prefetch (Optional[int]): Pages fetched ahead
+            cursor_field (Optional[str]): Field of a result that is its cursor
 
-        Yields:
-            dict: API response objects
+        Returns:
+            Paginator: Iterator over the API response objects
 
         """
-        if params is None:
-            params = dict()
-        url = self.url + endpoint
-        while True:
-            r = self.session.get(url, params=params, auth=self.auth, timeout=30)
-            results = r.json()
-            for result in results:
-                yield result
-            # If there are no more pages, we're done. Otherwise update `after`
-            # param to get next page.
-            # If this request included `before` don't get any more pages - the
-            # cbpro API doesn't support multiple pages in that case.
-            if not r.headers.get('cb-after') or \
-                    params.get('before') is not None:
-                break
-            else:
-                params['after'] = r.headers['cb-after']
+        return Paginator(self, endpoint, params=params, limit=limit, after=after, skip=skip, prefetch=prefetch,
+                         cursor_field=cursor_field)
@@ -0,0 +1,65 @@
+#
+# rate_limit.py
+#
+#
+# Token bucket that keeps rest api requests under the exchange's rate limits
+
+import threading
+import time
+
+# Public endpoints allow 3 requests per second, with bursts of up to 6
+PUBLIC_RATE = 3
+PUBLIC_BURST = 6
+
+
+class TokenBucket(object):
+    """Thread safe token bucket.
+
+    The bucket holds up to `burst` tokens and gains `rate` tokens per
+    second. Every request takes one token, waiting for it if the bucket is
+    empty, so requests never exceed `rate` per second on average or
+    `burst` at once.
+
+    Args:
+        rate (float): Tokens added per second.
+        burst (int): Size of the bucket. It starts full.
+        clock (Optional[callable]): Returns the current time in seconds. Defaults to time.monotonic.
+        sleep (Optional[callable]): Waits a number of seconds. Defaults to time.sleep.
+
+    """
+
+    def __init__(self, rate=PUBLIC_RATE, burst=PUBLIC_BURST, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = burst
+        self.updated = clock()
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Take a token if one is available. Returns False instead of waiting."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """Take a token, waiting until one is available. Returns the seconds waited."""
+        with self._lock:
+            self._refill()
+            # Reserve the token now, so waiting threads are served in the order they arrived
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited += wait
+        if wait:
+            self.sleep(wait)
+        return wait
@@ -0,0 +1,98 @@
+#
+# replay.py
+#
+#
+# Drives OrderBookFull offline from a feed recorded with WebsocketClient(record_path=...)
+# Run with: python replay.py feed.log.gz [--product BTC-USD] [--ticks]
+
+import argparse
+import time
+from collections import deque
+
+from book_manager import BookManager
+from feed_log import read_log, read_snapshots
+from OrderBookFull import OrderBookFull
+
+
+class ReplayClient(object):
+    '''
+    Stands in for PublicClient during a replay: snapshot requests are answered with the recorded snapshots of the
+    requested product, in order. Snapshots without a product_id tag are served to any product.
+    '''
+
+    def __init__(self, snapshots):
+        self.snapshots = iter(snapshots)
+        # Snapshots read ahead while looking for another product's snapshot
+        self.pending = {}
+
+    def get_product_order_book(self, product_id, level=1):
+        pending = self.pending.get(product_id)
+        if pending:
+            return pending.popleft()
+        for timestamp, snapshot in self.snapshots:
+            recordedProduct = snapshot.get('product_id')
+            if recordedProduct is None or recordedProduct == product_id:
+                return snapshot
+            self.pending.setdefault(recordedProduct, deque()).append(snapshot)
+        raise LookupError('No more recorded snapshots for {}'.format(product_id))
+
+
+# This function builds a book that is fed from recorded snapshots instead of the rest api
+def replayBook(snapshotPath, product_id='BTC-USD', use_ticks=False, quote_increment=None, base_increment=None,
+               checkpointPath=None):
+    '''
+    With checkpointPath the book starts from that checkpoint and only needs a recorded snapshot if the feed has a
+    gap after it, so snapshotPath may be None
+    '''
+    book = OrderBookFull(product_id=product_id, use_ticks=use_ticks,
+                         quote_increment=quote_increment, base_increment=base_increment)
+    book._client = ReplayClient(read_snapshots(snapshotPath) if snapshotPath else [])
+    # Load snapshots inline so the replay is deterministic, and stop when the recording runs out of snapshots
+    book.resync_in_background = False
+    book.resync_max_attempts = 1
+    if checkpointPath:
+        book.restoreCheckpoint(checkpointPath, confirm=False)
+    return book
+
+
+# This function builds a BookManager whose books are fed from recorded snapshots instead of the rest api
+def replayManager(snapshotPath, product_ids):
+    manager = BookManager(product_ids)
+    client = ReplayClient(read_snapshots(snapshotPath))
+    for book in manager.books.values():
+        book._client = client
+        book.resync_in_background = False
+        book.resync_max_attempts = 1
+    return manager
+
+
+# This function applies every recorded frame to the book (or BookManager) as fast as possible and returns (messages, seconds)
+def replayFeed(book, logPath):
+    count = 0
+    start = time.perf_counter()
+    for timestamp, frame in read_log(logPath):
+        # Decode like the live client does, so skipped message types are not decoded either
+        message = book.decode_frame(frame)
+        if message is not None:
+            book.processMessage(message)
+        count += 1
+    return count, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded full channel feed into OrderBookFull')
+    parser.add_argument('log', help='frame log written by WebsocketClient(record_path=...)')
+    parser.add_argument('--snapshots', help='snapshot log (defaults to LOG.snapshots)')
+    parser.add_argument('--product', default='BTC-USD')
+    parser.add_argument('--checkpoint', help='start from this checkpoint (written with checkpoint_path=...)')
+    parser.add_argument('--ticks', action='store_true', help='use the integer tick representation')
+    parser.add_argument('--quote-increment', default='0.01')
+    parser.add_argument('--base-increment', default='0.00000001')
+    args = parser.parse_args()
+
+    book = replayBook(args.snapshots or args.log + '.snapshots', product_id=args.product, use_ticks=args.ticks,
+                      quote_increment=args.quote_increment, base_increment=args.base_increment,
+                      checkpointPath=args.checkpoint)
+    count, elapsed = replayFeed(book, args.log)
+    print('{:,} messages in {:.3f}s ({:,.0f} messages/s), book at sequence {}'.format(
+        count, elapsed, count / elapsed if elapsed else 0, book.sequence))
@@ -0,0 +1,155 @@
+#
+# response_cache.py
+#
+#
+# TTL and LRU cache of rest api responses that sends concurrent identical requests only once
+
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds each endpoint's responses are kept by default
+DEFAULT_TTLS = {
+    'products': 300,
+    'currencies': 3600,
+    'stats': 10,
+    'time': 1,
+}
+
+
+class _Flight(object):
+    # A request in progress that other callers of the same key wait for
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache(object):
+    """Thread safe cache of rest api responses.
+
+    Responses are kept for the TTL of their endpoint and evicted least
+    recently used first once there are more than `max_entries`. When
+    several threads ask for the same missing key, only the first one makes
+    the request and the others wait for its response (or its exception,
+    which is not cached).
+
+    Cached responses are shared between callers, so they must not be
+    modified.
+
+    Args:
+        ttls (Optional[dict]): Seconds to keep responses, by endpoint name. Merged into DEFAULT_TTLS.
+        max_entries (Optional[int]): Most responses kept.
+        clock (Optional[callable]): Returns the current time in seconds. Defaults to time.monotonic.
+
+    """
+
+    def __init__(self, ttls=None, max_entries=256, clock=time.monotonic):
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.max_entries = max_entries
+        self.clock = clock
+        # key -> (expiry time, response), least recently used first
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.expired = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def get(self, endpoint, key, fetch):
+        """Return the cached response for key, calling fetch() to get it if it is missing or expired.
+
+        Args:
+            endpoint (str): Endpoint name, selects the TTL. Endpoints without a TTL are not cached.
+            key (hashable): Identifies the request, i.e. ('stats', product_id).
+            fetch (callable): Makes the request.
+
+        """
+        ttl = self.ttls.get(endpoint)
+        if not ttl:
+            return fetch()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expired += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = value = fetch()
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self.errors += 1
+                del self._flights[key]
+            flight.done.set()
+            raise
+        with self._lock:
+            self._entries[key] = (self.clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            del self._flights[key]
+        flight.done.set()
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one cached response, or all of them if key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """Return the cache's counters.
+
+        Returns:
+            dict: Example::
+                {
+                    "entries": 12,
+                    "hits": 1530,
+                    "misses": 41,
+                    "coalesced": 3,
+                    "expired": 29,
+                    "evictions": 0,
+                    "errors": 1,
+                    "hit_rate": 0.97
+                }
+
+        """
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'errors': self.errors,
+                'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,65 @@
+#
+# ring_buffer.py
+#
+#
+# Bounded ring buffer handing raw frames from the receive thread to the apply thread
+
+import threading
+
+
+class RingBuffer(object):
+    """Fixed capacity FIFO shared by one producer and one consumer thread.
+
+    `put` never blocks: when the buffer is full the new item is dropped and
+    counted. `drain` hands the consumer everything buffered (up to a batch
+    size) in one call.
+    """
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self._items = [None] * capacity
+        self._head = 0
+        self._count = 0
+        self._not_empty = threading.Condition(threading.Lock())
+        self.dropped = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return self._count
+
+    def put(self, item):
+        """Append an item. Returns False (and counts a drop) if the buffer is full."""
+        with self._not_empty:
+            if self._count == self.capacity:
+                self.dropped += 1
+                return False
+            self._items[(self._head + self._count) % self.capacity] = item
+            self._count += 1
+            if self._count > self.max_depth:
+                self.max_depth = self._count
+            self._not_empty.notify()
+            return True
+
+    def drain(self, max_items, timeout=None):
+        """Remove and return up to `max_items` items, oldest first.
+
+        Waits up to `timeout` seconds (forever if None) for the first item
+        and returns an empty list if none arrived.
+        """
+        with self._not_empty:
+            if not self._count and not self._not_empty.wait_for(lambda: self._count, timeout):
+                return []
+            n = min(max_items, self._count)
+            head = self._head
+            end = head + n
+            if end <= self.capacity:
+                batch = self._items[head:end]
+                self._items[head:end] = [None] * n
+            else:
+                wrapped = end - self.capacity
+                batch = self._items[head:] + self._items[:wrapped]
+                self._items[head:] = [None] * (self.capacity - head)
+                self._items[:wrapped] = [None] * wrapped
+            self._head = end % self.capacity
+            self._count -= n
+            return batch
@@ -0,0 +1,130 @@
+#
+# shared_top.py
+#
+#
+# Publishes the top of the book to a memory-mapped file that other processes can poll
+
+import mmap
+import os
+import struct
+import time
+
+_MAGIC = b'CBTOPv1\0'
+# magic, number of levels per side
+_LAYOUT = struct.Struct('<8sI4x')
+# version (odd while a write is in progress), book sequence, publish time, number of bid levels, number of ask levels
+_STATE = struct.Struct('<QqdII')
+_VERSION = struct.Struct('<Q')
+
+
+def _size(levels):
+    # Bid prices, bid sizes, ask prices and ask sizes follow the header as float64 arrays
+    return _LAYOUT.size + _STATE.size + 4 * 8 * levels
+
+
+class TopOfBookPublisher(object):
+    """Writes the best `levels` bid and ask levels into the file at `path`.
+
+    The file has a fixed layout: a header, then the version, book sequence,
+    publish time and level counts, then the bid prices, bid sizes, ask prices
+    and ask sizes as float64 arrays of `levels` entries. Writes follow a
+    seqlock protocol: the version is odd while a write is in progress and
+    is bumped to the next even number when it is complete, so readers never
+    need a lock. Put the file under /dev/shm to keep it in memory only.
+    """
+
+    def __init__(self, path, levels=10):
+        self.path = path
+        self.levels = levels
+        size = _size(levels)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._version = 0
+        _LAYOUT.pack_into(self._map, 0, _MAGIC, levels)
+        self._arrays = memoryview(self._map)[_LAYOUT.size + _STATE.size:].cast('d')
+        self.publish({'bids': [], 'asks': [], 'sequence': -1})
+
+    def publish(self, top):
+        """Write a top of book as passed to OrderBookFull.on_top_of_book_changed."""
+        levels = self.levels
+        bids = top['bids'][:levels]
+        asks = top['asks'][:levels]
+        arrays = self._arrays
+        # Mark the write as in progress
+        self._version += 1
+        _VERSION.pack_into(self._map, _LAYOUT.size, self._version)
+        for offset, side in ((0, bids), (2 * levels, asks)):
+            for i, level in enumerate(side):
+                arrays[offset + i] = float(level[0])
+                arrays[offset + levels + i] = float(level[1])
+        _STATE.pack_into(self._map, _LAYOUT.size, self._version, top['sequence'], time.time(), len(bids), len(asks))
+        # The version is written last, so a reader that sees the new version also sees everything written with it
+        self._version += 1
+        _VERSION.pack_into(self._map, _LAYOUT.size, self._version)
+
+    def close(self):
+        self._arrays.release()
+        self._map.close()
+
+
+class TopOfBookReader(object):
+    """Reads a top of book written by TopOfBookPublisher in another process.
+
+    `bid_prices`, `bid_sizes`, `ask_prices` and `ask_sizes` are float64
+    memoryviews straight into the shared file (i.e. numpy.frombuffer works
+    on them without a copy). Values read from them directly may be torn by
+    a concurrent write; `read()` returns a consistent copy and `changed()`
+    cheaply tells whether there is anything new to read.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.levels = _LAYOUT.unpack_from(self._map, 0)
+        if magic != _MAGIC:
+            self._map.close()
+            raise ValueError('{} is not a top of book file'.format(path))
+        levels = self.levels
+        arrays = memoryview(self._map)[_LAYOUT.size + _STATE.size:_size(levels)].cast('d')
+        self._arrays = arrays
+        self.bid_prices = arrays[0:levels]
+        self.bid_sizes = arrays[levels:2 * levels]
+        self.ask_prices = arrays[2 * levels:3 * levels]
+        self.ask_sizes = arrays[3 * levels:4 * levels]
+        self.last_version = None
+
+    @property
+    def version(self):
+        return _VERSION.unpack_from(self._map, _LAYOUT.size)[0]
+
+    def changed(self):
+        """True if a write completed since the last read()."""
+        version = self.version
+        return version != self.last_version and not version & 1
+
+    def read(self, max_attempts=1000):
+        """Return {'bids', 'asks', 'sequence', 'time', 'version'} from one complete write.
+
+        bids and asks are lists of (price, size), best first. Raises RuntimeError if no
+        consistent copy could be taken in max_attempts tries.
+        """
+        for _ in range(max_attempts):
+            version, sequence, published, bidCount, askCount = _STATE.unpack_from(self._map, _LAYOUT.size)
+            if version & 1:
+                # A write is in progress
+                continue
+            bids = list(zip(self.bid_prices[:bidCount].tolist(), self.bid_sizes[:bidCount].tolist()))
+            asks = list(zip(self.ask_prices[:askCount].tolist(), self.ask_sizes[:askCount].tolist()))
+            if self.version == version:
+                self.last_version = version
+                return {'bids': bids, 'asks': asks, 'sequence': sequence, 'time': published, 'version': version}
+        raise RuntimeError('Could not read a consistent top of book from the shared file')
+
+    def close(self):
+        for view in (self.bid_prices, self.bid_sizes, self.ask_prices, self.ask_sizes, self._arrays):
+            view.release()
+        self._map.close()
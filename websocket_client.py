@@ -9,16 +9,65 @@ import json
 import base64
 import hmac
 import hashlib
+import random
+import re
 import time
 from threading import Thread
-from websocket import create_connection, WebSocketConnectionClosedException
+from websocket import ABNF, create_connection, WebSocketConnectionClosedException, WebSocketTimeoutException
 from pymongo import MongoClient
 from cbpro_auth import get_auth_headers
+from feed_log import FeedRecorder
+from json_decoders import get_decoder
+from ring_buffer import RingBuffer
+from mongo_sink import MongoSink
+from metrics import FeedMetrics, format_stats
+
+_TYPE_RE = re.compile(r'"type":"([^"]*)"')
+_SEQUENCE_RE = re.compile(r'"sequence":(\d+)')
+_PRODUCT_ID_RE = re.compile(r'"product_id":"([^"]*)"')
+_HEARTBEAT_PREFIX = '{"type":"heartbeat"'
+_HEARTBEAT_PREFIX_BYTES = _HEARTBEAT_PREFIX.encode('utf-8')
+# Longest a blocking recv waits before the watchdog and the stop flag are checked again
+_POLL_SECONDS = 1.0
+# Timeout of the socket operations of connecting and subscribing
+_CONNECT_TIMEOUT = 30
+# Seconds a connection has to stay up before the reconnect backoff starts over
+_STABLE_SECONDS = 30
+
+
+class ConnectionLost(Exception):
+    """Raised by the watchdog when nothing was received for `heartbeat_timeout` seconds."""
+    pass
+
+
+def skeleton_message(data):
+    """Extract only the type, sequence and product_id of a raw frame.
+
+    This is much cheaper than decoding the whole frame. It is meant for
+    frames that are dropped by `skip_types` but whose sequence number still
+    has to be accounted for.
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    msg = {}
+    match = _TYPE_RE.search(data)
+    if match:
+        msg['type'] = match.group(1)
+    match = _SEQUENCE_RE.search(data)
+    if match:
+        msg['sequence'] = int(match.group(1))
+    match = _PRODUCT_ID_RE.search(data)
+    if match:
+        msg['product_id'] = match.group(1)
+    return msg
 
 
 class WebsocketClient(object):
     def __init__(self, url="wss://ws-feed.pro.coinbase.com", products=None, message_type="subscribe", mongo_collection=None,
-                 should_print=True, auth=False, api_key="", api_secret="", api_passphrase="", channels=None):
+                 should_print=True, auth=False, api_key="", api_secret="", api_passphrase="", channels=None,
+                 record_path=None, decoder='auto', skip_types=None, pipeline=False, buffer_size=65536, max_batch=512,
+                 mongo_sink=None, metrics=False, stats_interval=None, reconnect=True, heartbeat=True,
+                 heartbeat_timeout=15, ping_interval=5, initial_backoff=0.5, max_backoff=30, max_reconnects=None):
         self.url = url
         self.products = products
         self.channels = channels
@@ -33,19 +82,174 @@ class WebsocketClient(object):
         self.api_passphrase = api_passphrase
         self.should_print = should_print
         self.mongo_collection = mongo_collection
+        # Messages are written to mongo_collection in batches on a background thread (see mongo_sink.py).
+        # Pass a MongoSink to choose its batch size, flush interval and overflow policy
+        self.mongo_sink = mongo_sink
+        self._owns_mongo_sink = False
+        # When set, every raw frame is appended to this log (see feed_log.py)
+        self.record_path = record_path
+        self.recorder = None
+        # Function decoding a raw frame (see json_decoders.get_decoder)
+        self.decode = get_decoder(decoder)
+        # Message types the subscriber does not need. Their frames are handed to on_skipped without being decoded
+        self.skip_types = tuple(skip_types or ())
+        self._skip_prefixes = None
+        # With pipeline=True one thread only receives frames into a ring buffer of buffer_size frames, and a
+        # second thread decodes and applies them in batches of at most max_batch (see pipeline_stats)
+        self.pipeline = pipeline
+        self.buffer_size = buffer_size
+        self.max_batch = max_batch
+        self.frames = None
+        self.batches = 0
+        self.batched_frames = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        # With metrics=True (or a FeedMetrics) decode, apply and publish times, message counts and feed lag are
+        # recorded (see stats). With stats_interval as well, on_stats gets a snapshot every stats_interval seconds
+        if metrics is True:
+            metrics = FeedMetrics()
+        self.metrics = metrics or None
+        self.stats_interval = stats_interval
+        self._next_stats = None
+        # With reconnect=True a lost connection is reopened and subscribed again (see on_reconnect). The first
+        # attempt is immediate, later ones wait a jittered backoff doubling from initial_backoff up to max_backoff.
+        # A ping goes out every ping_interval seconds, and the connection counts as lost when nothing (not even the
+        # pong) arrived for heartbeat_timeout seconds, so a quiet but healthy subscription is never dropped.
+        # heartbeat=True also subscribes to the heartbeat channel (when channels are given), so there is a frame
+        # every second per product. Heartbeat frames are only used by the watchdog and never reach on_message
+        if ping_interval >= heartbeat_timeout:
+            raise ValueError('ping_interval must be shorter than heartbeat_timeout')
+        self.reconnect = reconnect
+        self.heartbeat = heartbeat
+        self.heartbeat_timeout = heartbeat_timeout
+        self.ping_interval = ping_interval
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_reconnects = max_reconnects
+        self.reconnects = 0
+        # Seconds from losing the connection to being subscribed again, for the last reconnect
+        self.last_recovery = None
+        self._last_ping = 0
+        self._last_frame = 0
 
     def start(self):
+        if self.record_path and self.recorder is None:
+            self.recorder = FeedRecorder(self.record_path)
+        if self.mongo_collection and self.mongo_sink is None:
+            self.mongo_sink = MongoSink(self.mongo_collection)
+            self._owns_mongo_sink = True
+
         def _go():
-            self._connect()
-            self._listen()
-            self._disconnect()
+            applier = None
+            if self.pipeline:
+                # The apply thread outlives reconnects, it stops once everything received has been applied
+                self.frames = RingBuffer(self.buffer_size)
+                applier = Thread(target=self._apply)
+                applier.start()
+            try:
+                self._supervise()
+            finally:
+                self.stop = True
+                if applier is not None:
+                    applier.join()
+                self._disconnect()
 
         self.stop = False
         self.on_open()
         self.thread = Thread(target=_go)
         self.thread.start()
 
+    def _supervise(self):
+        # Runs connections until close(), reconnecting with backoff when one is lost
+        attempts = 0
+        lost = None
+        while not self.stop:
+            try:
+                self._connect()
+            except Exception as e:
+                self.on_error(e)
+                attempts += 1
+                if lost is None:
+                    lost = time.monotonic()
+                if not self._wait_to_reconnect(attempts):
+                    return
+                continue
+            if lost is not None:
+                self._recovered(lost, attempts)
+                lost = None
+            connected = time.monotonic()
+            if self.pipeline:
+                self._receive()
+            else:
+                self._listen()
+            self._close_socket()
+            if self.stop:
+                return
+            lost = time.monotonic()
+            if lost - connected >= _STABLE_SECONDS:
+                attempts = 0
+            else:
+                # A server that accepts and then drops the connection straight away is backed off from like a
+                # failed connect, instead of being reconnected to (and every book resynced) in a tight loop
+                attempts += 1
+            if self.metrics is not None:
+                self.metrics.record_disconnect()
+            if not self._wait_to_reconnect(attempts):
+                return
+
+    # This method returns the seconds to wait before reconnect attempt number `attempts` (0 is the first one), or
+    # None if the client should stop instead
+    def _reconnect_delay(self, attempts):
+        if not self.reconnect or self.stop:
+            self.stop = True
+            return None
+        if self.max_reconnects is not None and attempts >= self.max_reconnects:
+            print('Giving up after {} failed reconnects'.format(attempts))
+            self.stop = True
+            return None
+        if not attempts:
+            return 0
+        # Jittered exponential backoff: a random delay between half and all of the doubled backoff
+        delay = min(self.max_backoff, self.initial_backoff * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
+
+    # This method waits before reconnect attempt number `attempts` and returns False if the client should stop instead
+    def _wait_to_reconnect(self, attempts):
+        delay = self._reconnect_delay(attempts)
+        if delay is None:
+            return False
+        until = time.monotonic() + delay
+        while not self.stop and time.monotonic() < until:
+            time.sleep(min(0.1, max(0, until - time.monotonic())))
+        return not self.stop
+
+    def _recovered(self, lost, attempts):
+        self.reconnects += 1
+        self.last_recovery = time.monotonic() - lost
+        if self.metrics is not None:
+            self.metrics.record_reconnect(int(self.last_recovery * 1e9), attempts + 1)
+        self.on_reconnect()
+
     def _connect(self):
+        sub_params = self._subscribe_params()
+
+        self.ws = create_connection(self.url, timeout=_CONNECT_TIMEOUT)
+
+        self.ws.send(json.dumps(sub_params))
+        # From now on recv gives up after _POLL_SECONDS so the watchdog, the keepalive ping and close() are never
+        # blocked for long
+        self.ws.settimeout(_POLL_SECONDS)
+        self._last_ping = self._last_frame = time.monotonic()
+
+    def _close_socket(self):
+        try:
+            if self.ws:
+                self.ws.close()
+        except Exception:
+            pass
+        self.ws = None
+
+    def _subscribe_params(self):
         if self.products is None:
             self.products = ["BTC-USD"]
         elif not isinstance(self.products, list):
@@ -54,10 +258,13 @@ class WebsocketClient(object):
         if self.url[-1] == "/":
             self.url = self.url[:-1]
 
-        if self.channels is None:
+        channels = self.channels
+        if self.heartbeat and channels and 'heartbeat' not in channels:
+            channels = list(channels) + ['heartbeat']
+        if channels is None:
             sub_params = {'type': 'subscribe', 'product_ids': self.products}
         else:
-            sub_params = {'type': 'subscribe', 'product_ids': self.products, 'channels': self.channels}
+            sub_params = {'type': 'subscribe', 'product_ids': self.products, 'channels': channels}
 
         if self.auth:
             timestamp = str(time.time())
@@ -68,33 +275,253 @@ class WebsocketClient(object):
             sub_params['passphrase'] = auth_headers['CB-ACCESS-PASSPHRASE']
             sub_params['timestamp'] = auth_headers['CB-ACCESS-TIMESTAMP']
 
-        self.ws = create_connection(self.url)
+        return sub_params
 
-        self.ws.send(json.dumps(sub_params))
+    # This method returns the next frame, or None once the client is stopped. It raises when the connection is lost
+    def _recv(self):
+        while True:
+            now = time.monotonic()
+            if now - self._last_ping >= self.ping_interval:
+                # Ping every ping_interval seconds to keep the connection alive
+                self.ws.ping("keepalive")
+                self._last_ping = now
+            try:
+                # Control frames are returned too, so pongs count as signs of life
+                opcode, data = self.ws.recv_data(control_frame=True)
+            except WebSocketTimeoutException:
+                if self.stop:
+                    return None
+                if time.monotonic() - self._last_frame >= self.heartbeat_timeout:
+                    raise ConnectionLost('Nothing received for {} seconds'.format(self.heartbeat_timeout))
+                continue
+            self._last_frame = time.monotonic()
+            if opcode == ABNF.OPCODE_TEXT:
+                if isinstance(data, bytes):
+                    data = data.decode('utf-8')
+            elif opcode == ABNF.OPCODE_CLOSE:
+                raise WebSocketConnectionClosedException('Connection closed by the server')
+            elif opcode != ABNF.OPCODE_BINARY:
+                # Pong, or a ping websocket-client has already answered
+                continue
+            if not data:
+                raise WebSocketConnectionClosedException('Connection closed by the server')
+            if self.recorder:
+                self.recorder.write_frame(data)
+            return data
 
+    # This method handles frames until the client is stopped or the connection is lost
     def _listen(self):
+        if self.metrics is not None:
+            return self._listen_timed()
         while not self.stop:
             try:
-                start_t = 0
-                if time.time() - start_t >= 30:
-                    # Set a 30 second ping to keep connection alive
-                    self.ws.ping("keepalive")
-                    start_t = time.time()
-                data = self.ws.recv()
-                msg = json.loads(data)
-            except ValueError as e:
+                data = self._recv()
+            except Exception as e:
                 self.on_error(e)
+                return
+            if data is None:
+                return
+            # Like in _apply, any error handling a frame is reported and the loop goes on. Otherwise it would end
+            # the feed thread without a reconnect
+            try:
+                msg = self.decode_frame(data)
+                if msg is not None:
+                    self.on_message(msg)
+            except Exception as e:
+                self.on_error(e, data)
+            try:
+                self.on_batch_end()
             except Exception as e:
                 self.on_error(e)
-            else:
-                self.on_message(msg)
+
+    def _listen_timed(self):
+        # _listen with every stage timed, kept apart so the uninstrumented loop pays nothing for it
+        while not self.stop:
+            try:
+                data = self._recv()
+            except Exception as e:
+                self.on_error(e)
+                return
+            if data is None:
+                return
+            try:
+                start = time.perf_counter_ns()
+                msg = self.decode_frame(data)
+                self._on_message_timed(msg, time.perf_counter_ns() - start)
+            except Exception as e:
+                self.on_error(e, data)
+            try:
+                self._batch_end_timed()
+            except Exception as e:
+                self.on_error(e)
+
+    def _on_message_timed(self, msg, decode_ns):
+        # on_message for a decoded frame (None if it was skipped), recording its decode and apply times
+        if msg is None:
+            self.metrics.record_message('skipped', decode_ns)
+            return
+        start = time.perf_counter_ns()
+        self.on_message(msg)
+        self.metrics.record_message(msg.get('type'), decode_ns, time.perf_counter_ns() - start, msg.get('time'))
+
+    def _batch_end_timed(self):
+        start = time.perf_counter_ns()
+        self.on_batch_end()
+        self.metrics.record_publish(time.perf_counter_ns() - start)
+        if self.stats_interval:
+            now = time.monotonic()
+            if self._next_stats is None:
+                self._next_stats = now + self.stats_interval
+            elif now >= self._next_stats:
+                self._next_stats = now + self.stats_interval
+                self.on_stats(self.stats())
+
+    def _receive(self):
+        # Receive stage of the pipeline: only read frames into the ring buffer
+        while not self.stop:
+            try:
+                data = self._recv()
+            except Exception as e:
+                self.on_error(e)
+                return
+            if data is None:
+                return
+            self.frames.put(data)
+
+    def _apply(self):
+        # Apply stage of the pipeline: decode and handle everything received since the last batch
+        while not self.stop or len(self.frames):
+            batch = self.frames.drain(self.max_batch, timeout=0.1)
+            if not batch:
+                continue
+            metrics = self.metrics
+            if metrics is not None:
+                # Frames still waiting behind this batch
+                metrics.record_queue_depth(len(self.frames))
+            for data in batch:
+                # Any error handling a frame is reported and the thread goes on, otherwise it would die silently
+                # while the receive thread keeps filling the ring buffer
+                try:
+                    start = time.perf_counter_ns() if metrics is not None else 0
+                    msg = self.decode_frame(data)
+                    if metrics is not None:
+                        self._on_message_timed(msg, time.perf_counter_ns() - start)
+                    elif msg is not None:
+                        self.on_message(msg)
+                except Exception as e:
+                    self.on_error(e, data)
+            self.batches += 1
+            self.batched_frames += len(batch)
+            self.last_batch_size = len(batch)
+            if len(batch) > self.max_batch_size:
+                self.max_batch_size = len(batch)
+            try:
+                if metrics is not None:
+                    self._batch_end_timed()
+                else:
+                    self.on_batch_end()
+            except Exception as e:
+                self.on_error(e)
+
+    def pipeline_stats(self):
+        """Return receive/apply pipeline counters.
+
+        Returns:
+            dict: Example::
+                {
+                    "queue_depth": 12,
+                    "max_queue_depth": 840,
+                    "dropped_frames": 0,
+                    "batches": 10324,
+                    "last_batch_size": 3,
+                    "mean_batch_size": 4.2,
+                    "max_batch_size": 512
+                }
+
+        """
+        frames = self.frames
+        return {
+            'queue_depth': len(frames) if frames is not None else 0,
+            'max_queue_depth': frames.max_depth if frames is not None else 0,
+            'dropped_frames': frames.dropped if frames is not None else 0,
+            'batches': self.batches,
+            'last_batch_size': self.last_batch_size,
+            'mean_batch_size': self.batched_frames / self.batches if self.batches else 0,
+            'max_batch_size': self.max_batch_size,
+        }
+
+    def stats(self):
+        """Return a snapshot of the feed's metrics.
+
+        Without metrics only the pipeline counters are returned. See
+        FeedMetrics.snapshot for the rest; times are in microseconds.
+
+        Returns:
+            dict: Example::
+                {
+                    "uptime": 62.1,
+                    "messages": {"open": 51210, "done": 50876, "match": 3120, "change": 12, "skipped": 52004},
+                    "decode": {"open": {"count": 51210, "mean": 2.1, "p50": 1.9, "p99": 6.3, ...}, ...},
+                    "apply": {"open": {...}, ...},
+                    "publish": {...},
+                    "lag": {...},
+                    "negative_lag": 0,
+                    "gaps": 0,
+                    "missed_messages": 0,
+                    "resyncs": 1,
+                    "resync": {...},
+                    "resync_buffer": {...},
+                    "queue_depth": {...},
+                    "disconnects": 1,
+                    "reconnects": 1,
+                    "reconnect_attempts": {...},
+                    "recover": {...},
+                    "pipeline": {...}
+                }
+
+        """
+        stats = self.metrics.snapshot() if self.metrics is not None else {}
+        if self.pipeline:
+            stats['pipeline'] = self.pipeline_stats()
+        return stats
+
+    def on_stats(self, stats):
+        """Called with a stats snapshot every `stats_interval` seconds."""
+        print(format_stats(stats))
+
+    def decode_frame(self, data):
+        """Decode a raw frame, or return None if its type is in `skip_types`.
+
+        Coinbase frames start with their type (i.e. '{"type":"received",'),
+        so skipped frames are recognised by their prefix before any decoding.
+        Frames that are laid out differently are simply decoded as usual.
+        Heartbeat frames are dropped here too, without calling on_skipped.
+        """
+        if self.heartbeat and data.startswith(_HEARTBEAT_PREFIX_BYTES if isinstance(data, bytes) else _HEARTBEAT_PREFIX):
+            return None
+        if self.skip_types:
+            if self._skip_prefixes is None or self._skip_prefixes[0] is not self.skip_types:
+                prefixes = tuple('{{"type":"{}"'.format(t) for t in self.skip_types)
+                self._skip_prefixes = (self.skip_types, prefixes, tuple(p.encode('utf-8') for p in prefixes))
+            if data.startswith(self._skip_prefixes[2 if isinstance(data, bytes) else 1]):
+                self.on_skipped(data)
+                return None
+        return self.decode(data)
 
     def _disconnect(self):
-        try:
-            if self.ws:
-                self.ws.close()
-        except WebSocketConnectionClosedException as e:
-            pass
+        self._close_socket()
+
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+
+        if self._owns_mongo_sink:
+            # Write out whatever is still buffered
+            self.mongo_sink.close()
+            self.mongo_sink = None
+            self._owns_mongo_sink = False
+        elif self.mongo_sink:
+            self.mongo_sink.flush()
 
         self.on_close()
 
@@ -113,12 +540,34 @@ class WebsocketClient(object):
     def on_message(self, msg):
         if self.should_print:
             print(msg)
-        if self.mongo_collection:  # dump JSON to given mongo collection
-            self.mongo_collection.insert_one(msg)
+        if self.mongo_sink:  # dump JSON to given mongo collection
+            self.mongo_sink.put(msg)
+
+    def on_batch_end(self):
+        """Called after each batch of messages has been handed to on_message.
+
+        Without the pipeline every message is its own batch.
+        """
+        pass
+
+    def on_skipped(self, data):
+        """Called with the raw frame of every message dropped by `skip_types`."""
+        pass
+
+    def on_reconnect(self):
+        """Called after a lost connection has been reopened and subscribed again.
+
+        Messages sent while the connection was down are lost. Clients that
+        keep state from the feed should reload it here.
+        """
+        if self.should_print:
+            print("-- Reconnected after {:.1f} seconds --".format(self.last_recovery))
 
     def on_error(self, e, data=None):
+        """Called with every error. A lost connection is reopened afterwards unless reconnect is False."""
         self.error = e
-        self.stop = True
+        if not self.reconnect:
+            self.stop = True
         print('{} - data: {}'.format(e, data))
 
 
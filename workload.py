@@ -0,0 +1,252 @@
+#
+# workload.py
+#
+#
+# Seeded generator of synthetic full channel traffic for benchmarking the order book
+
+import datetime as dt
+import random
+import uuid
+from collections import deque
+
+from sortedcontainers import SortedDict
+
+
+class FullChannelWorkload(object):
+    '''
+    Simulates a single product matching engine and emits the messages the full channel would send for it.
+
+    depth: number of price levels (ticks) on each side of the mid that new resting orders are placed in
+    ordersPerLevel: number of resting orders per level in the initial snapshot
+    cancelRatio: share of events that cancel a resting order (the rest place, match or change orders)
+    takerRatio: share of new orders that cross the spread and match
+    marketRatio: share of new orders that are market orders
+    changeRatio: share of events that reduce the size of a resting order
+    '''
+
+    def __init__(self, seed=1, depth=500, ordersPerLevel=20, cancelRatio=0.45, takerRatio=0.08, marketRatio=0.02,
+                 changeRatio=0.01, mid=30000.0, tick=0.01, product_id='BTC-USD'):
+        self.rng = random.Random(seed)
+        self.depth = depth
+        self.ordersPerLevel = ordersPerLevel
+        self.cancelRatio = cancelRatio
+        self.takerRatio = takerRatio
+        self.marketRatio = marketRatio
+        self.changeRatio = changeRatio
+        self.tick = tick
+        self.product_id = product_id
+        self.sequence = 1
+        self.tradeId = 1
+        self.time = dt.datetime(2020, 1, 1)
+        self._pending = []
+
+        # Resting orders: order ID -> [side, price in ticks, size in satoshis]
+        self.orders = {}
+        # Order IDs in a list (with their positions) so a random order can be picked and removed in O(1)
+        self.orderIds = []
+        self.orderPositions = {}
+        # Price in ticks -> queue of order IDs, per side
+        self.levels = {'buy': SortedDict(), 'sell': SortedDict()}
+
+        midTicks = int(round(mid / tick))
+        for i in range(1, depth + 1):
+            for _ in range(ordersPerLevel):
+                self._rest(self._newId(), 'buy', midTicks - i, self._newSize())
+                self._rest(self._newId(), 'sell', midTicks + i, self._newSize())
+
+    # This method returns a level 3 rest api snapshot of the current state
+    def snapshot(self):
+        def rows(side):
+            tree = self.levels[side]
+            prices = reversed(tree) if side == 'buy' else iter(tree)
+            return [[self._price(price), self._size(self.orders[orderId][2]), orderId]
+                    for price in prices for orderId in tree[price]]
+        return {'sequence': self.sequence - 1, 'bids': rows('buy'), 'asks': rows('sell')}
+
+    # This method returns the next n messages
+    def messages(self, n):
+        # Messages of the last event that did not fit in the previous call come first
+        out = self._pending
+        while len(out) < n:
+            self._event(out)
+        self._pending = out[n:]
+        return out[:n]
+
+    # This method returns a level2 channel snapshot message of the current state
+    def level2Snapshot(self):
+        def rows(side):
+            tree = self.levels[side]
+            prices = reversed(tree) if side == 'buy' else iter(tree)
+            return [[self._price(price), self._size(self._levelSize(side, price))] for price in prices]
+        return {'type': 'snapshot', 'product_id': self.product_id, 'bids': rows('buy'), 'asks': rows('sell')}
+
+    # This method returns n level2 channel l2update messages
+    def level2Updates(self, n, maxEventsPerUpdate=8):
+        '''
+        Each update carries the new total size of every level touched by 1 to maxEventsPerUpdate matching engine
+        events. Do not interleave with messages(), whose leftover messages describe events already applied here.
+        '''
+        updates = []
+        while len(updates) < n:
+            out = []
+            for _ in range(self.rng.randint(1, maxEventsPerUpdate)):
+                self._event(out)
+            touched = {}
+            for message in out:
+                if 'price' in message and message['type'] != 'received':
+                    touched[(message['side'], message['price'])] = None
+            if not touched:
+                # Market orders that found nothing to match
+                continue
+            changes = []
+            for side, price in touched:
+                ticks = int(round(float(price) / self.tick))
+                changes.append([side, price, self._size(self._levelSize(side, ticks))])
+            updates.append({'type': 'l2update', 'product_id': self.product_id, 'time': out[-1]['time'],
+                            'changes': changes})
+        return updates
+
+    # This method applies one random matching engine event and appends its messages to out
+    def _event(self, out):
+        r = self.rng.random()
+        if r < self.cancelRatio and self.orderIds:
+            self._cancel(out)
+        elif r < self.cancelRatio + self.changeRatio and self.orderIds:
+            self._change(out)
+        else:
+            self._place(out)
+
+    # This method returns the total size in satoshis resting at a price, 0 for an empty level
+    def _levelSize(self, side, price):
+        level = self.levels[side].get(price)
+        if not level:
+            return 0
+        return sum(self.orders[orderId][2] for orderId in level)
+
+    def _place(self, out):
+        side = 'buy' if self.rng.random() < 0.5 else 'sell'
+        orderId = self._newId()
+        size = self._newSize()
+        r = self.rng.random()
+        if r < self.marketRatio:
+            self._emit(out, 'received', order_id=orderId, side=side, order_type='market',
+                       size=self._size(size))
+            self._take(out, orderId, side, size, None)
+            self._emit(out, 'done', order_id=orderId, side=side, reason='filled')
+            return
+
+        bestAsk, bestBid = self._best()
+        opposite = bestAsk if side == 'buy' else bestBid
+        if r < self.marketRatio + self.takerRatio and opposite is not None:
+            # Cross the spread by a few ticks
+            limit = opposite + (1 if side == 'buy' else -1) * self.rng.randint(0, 3)
+        else:
+            # Rest a geometric number of ticks behind the touch of our own side
+            offset = min(int(self.rng.expovariate(0.05)), self.depth)
+            if side == 'buy':
+                touch = bestBid if bestBid is not None else (bestAsk or 2) - 1
+                limit = touch - offset
+            else:
+                touch = bestAsk if bestAsk is not None else (bestBid or 0) + 1
+                limit = touch + offset
+        limit = max(limit, 1)
+        self._emit(out, 'received', order_id=orderId, side=side, order_type='limit',
+                   price=self._price(limit), size=self._size(size))
+        remaining = self._take(out, orderId, side, size, limit)
+        if remaining:
+            self._rest(orderId, side, limit, remaining)
+            self._emit(out, 'open', order_id=orderId, side=side, price=self._price(limit),
+                       remaining_size=self._size(remaining))
+        else:
+            self._emit(out, 'done', order_id=orderId, side=side, price=self._price(limit), reason='filled',
+                       remaining_size=self._size(0))
+
+    # This method matches a taker order against resting orders and returns the unfilled size
+    def _take(self, out, takerId, side, size, limit):
+        makerSide = 'sell' if side == 'buy' else 'buy'
+        tree = self.levels[makerSide]
+        while size and tree:
+            price = tree.peekitem(0 if makerSide == 'sell' else -1)[0]
+            if limit is not None and (price > limit if side == 'buy' else price < limit):
+                break
+            makerId = tree[price][0]
+            maker = self.orders[makerId]
+            filled = min(size, maker[2])
+            size -= filled
+            self._emit(out, 'match', trade_id=self._nextTradeId(), maker_order_id=makerId, taker_order_id=takerId,
+                       side=makerSide, price=self._price(price), size=self._size(filled))
+            if filled == maker[2]:
+                self._unrest(makerId)
+                self._emit(out, 'done', order_id=makerId, side=makerSide, price=self._price(price),
+                           reason='filled', remaining_size=self._size(0))
+            else:
+                maker[2] -= filled
+        return size
+
+    def _cancel(self, out):
+        orderId = self.rng.choice(self.orderIds)
+        side, price, size = self.orders[orderId]
+        self._unrest(orderId)
+        self._emit(out, 'done', order_id=orderId, side=side, price=self._price(price), reason='canceled',
+                   remaining_size=self._size(size))
+
+    def _change(self, out):
+        orderId = self.rng.choice(self.orderIds)
+        order = self.orders[orderId]
+        newSize = max(1, order[2] // 2)
+        self._emit(out, 'change', order_id=orderId, side=order[0], price=self._price(order[1]),
+                   old_size=self._size(order[2]), new_size=self._size(newSize))
+        order[2] = newSize
+
+    def _rest(self, orderId, side, price, size):
+        self.orders[orderId] = [side, price, size]
+        self.orderPositions[orderId] = len(self.orderIds)
+        self.orderIds.append(orderId)
+        level = self.levels[side].get(price)
+        if level is None:
+            level = self.levels[side][price] = deque()
+        level.append(orderId)
+
+    def _unrest(self, orderId):
+        side, price, size = self.orders.pop(orderId)
+        # Swap the last ID into the removed slot
+        position = self.orderPositions.pop(orderId)
+        last = self.orderIds.pop()
+        if last != orderId:
+            self.orderIds[position] = last
+            self.orderPositions[last] = position
+        level = self.levels[side][price]
+        level.remove(orderId)
+        if not level:
+            del self.levels[side][price]
+
+    # This method returns (best ask, best bid) in ticks, None for an empty side
+    def _best(self):
+        asks = self.levels['sell']
+        bids = self.levels['buy']
+        return (asks.peekitem(0)[0] if asks else None, bids.peekitem(-1)[0] if bids else None)
+
+    def _emit(self, out, msgType, **fields):
+        self.time += dt.timedelta(microseconds=self.rng.randint(50, 5000))
+        message = {'type': msgType, 'product_id': self.product_id, 'sequence': self.sequence,
+                   'time': self.time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')}
+        message.update(fields)
+        self.sequence += 1
+        out.append(message)
+
+    def _newId(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128)))
+
+    def _newSize(self):
+        # Sizes between 0.0001 and about 2 BTC, in satoshis
+        return self.rng.randint(10000, 200000000)
+
+    def _nextTradeId(self):
+        self.tradeId += 1
+        return self.tradeId
+
+    def _price(self, ticks):
+        return '{0:.2f}'.format(ticks * self.tick)
+
+    def _size(self, satoshis):
+        return '{0:.8f}'.format(satoshis / 100000000.0)